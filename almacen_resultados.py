@@ -0,0 +1,391 @@
+"""
+Almacén de resultados en SQLite con campos tipados y normalizados
+
+Guarda una fila por contrato con la fecha parseada, el importe numérico y su
+moneda, el valor total del contrato, la duración en meses y las partes, indexados para consultas de
+cartera, junto con las respuestas originales y los metadatos de la ejecución.
+"""
+
+import json
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contratos (
+    id INTEGER PRIMARY KEY,
+    documento TEXT NOT NULL UNIQUE,
+    fecha_analisis TEXT NOT NULL,
+    modelo TEXT,
+    tipo_contrato TEXT,
+    empresa_principal TEXT COLLATE NOCASE,
+    contraparte TEXT COLLATE NOCASE,
+    fecha_contrato TEXT,
+    fecha_vencimiento TEXT,
+    duracion_meses INTEGER,
+    importe REAL,
+    moneda TEXT,
+    periodicidad TEXT,
+    valor_total REAL,
+    lugar_firma TEXT,
+    respuestas TEXT NOT NULL,
+    resumen TEXT,
+    analisis_riesgos TEXT,
+    metadatos TEXT
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_contratos_fecha ON contratos (fecha_contrato);
+CREATE INDEX IF NOT EXISTS idx_contratos_vencimiento ON contratos (fecha_vencimiento);
+CREATE INDEX IF NOT EXISTS idx_contratos_empresa ON contratos (empresa_principal);
+DROP INDEX IF EXISTS idx_contratos_moneda_contraparte;
+CREATE INDEX IF NOT EXISTS idx_contratos_moneda_contraparte_valor
+    ON contratos (moneda, contraparte, valor_total);
+"""
+
+# Meses que cubre cada importe periódico
+MESES_POR_PERIODO = {"mensual": 1, "trimestral": 3, "anual": 12}
+
+MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12
+}
+
+NUMEROS = {
+    "un": 1, "uno": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "once": 11,
+    "doce": 12, "quince": 15, "dieciocho": 18, "veinte": 20, "veinticuatro": 24,
+    "treinta": 30, "treinta y seis": 36, "cuarenta y ocho": 48, "sesenta": 60
+}
+
+MONEDAS = [
+    ("EUR", re.compile(r"€|\beur(?:o|os)?\b", re.IGNORECASE)),
+    ("USD", re.compile(r"\$|\busd\b|\bd[óo]lar(?:es)?\b", re.IGNORECASE)),
+    ("GBP", re.compile(r"£|\bgbp\b|\blibras?\b", re.IGNORECASE)),
+    ("CHF", re.compile(r"\bchf\b|\bfrancos? suizos?\b", re.IGNORECASE)),
+    ("MXN", re.compile(r"\bmxn\b|\bpesos? mexicanos?\b", re.IGNORECASE))
+]
+
+PERIODICIDADES = [
+    ("mensual", re.compile(r"\bmensual(?:es|mente)?\b|al mes\b|por mes\b", re.IGNORECASE)),
+    ("anual", re.compile(r"\banual(?:es|mente)?\b|al año\b|por año\b", re.IGNORECASE)),
+    ("trimestral", re.compile(r"\btrimestral(?:es|mente)?\b", re.IGNORECASE))
+]
+
+# Abreviaturas finales cuyo punto forma parte del nombre (S.L., S.A.U., Inc.)
+LEGAL_FORM = re.compile(
+    r"(?:\b[^\W\d_]{1,5}\.){2,}$|\b(?:inc|ltd|corp|co|c[íi]a|bros)\.$",
+    re.IGNORECASE
+)
+
+# Respuestas que indican que el dato no aparece en el contrato
+NOT_SPECIFIED = re.compile(
+    r"^(?:no (?:se )?(?:especifica|menciona|indica|establece|identifica|consta|aparece|"
+    r"encuentra|hay)|no especificad[oa]|sin especificar|desconocid[oa]|n/?a\b)",
+    re.IGNORECASE
+)
+
+AMOUNT = re.compile(r"\d{1,3}(?:[.,\s]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?")
+DURATION_UNITS = {"d": 1 / 30, "s": 7 / 30, "m": 1, "a": 12}
+DURATION = re.compile(
+    r"\b(\d+|" + "|".join(sorted(NUMEROS, key=len, reverse=True)) + r")\s*(?:\(\d+\)\s*)?"
+    r"(d[íi]as?|semanas?|mes(?:es)?|a[ñn]os?)\b",
+    re.IGNORECASE
+)
+
+
+def _clean(value: Optional[str]) -> str:
+    """Quita el formato markdown y los espacios sobrantes de una respuesta"""
+    if not value:
+        return ""
+    value = value.replace("**", "").replace("__", "")
+    return re.sub(r"\s+", " ", value).strip()
+
+
+def _clean_field(value: Optional[str]) -> Optional[str]:
+    """
+    Respuesta corta lista para guardar en una columna
+
+    Quita el punto final salvo en formas jurídicas abreviadas y devuelve None
+    si la respuesta indica que el dato no aparece en el contrato.
+    """
+    value = _clean(value)
+    if not value or NOT_SPECIFIED.match(value):
+        return None
+    if not LEGAL_FORM.search(value):
+        value = value.rstrip(".").strip()
+    return value or None
+
+
+def parse_date(text: Optional[str]) -> Optional[date]:
+    """
+    Extrae una fecha de una respuesta libre
+
+    Admite DD/MM/YYYY, YYYY-MM-DD y "27 de noviembre de 2025".
+    """
+    text = _clean(text).lower()
+    match = re.search(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b", text)
+    if match:
+        year, month, day = (int(g) for g in match.groups())
+    else:
+        match = re.search(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b", text)
+        if match:
+            day, month, year = (int(g) for g in match.groups())
+        else:
+            match = re.search(r"\b(\d{1,2})\s+de\s+([a-z]+)\s+(?:de|del)\s+(\d{4})\b", text)
+            if not match or match.group(2) not in MESES:
+                return None
+            day, month, year = int(match.group(1)), MESES[match.group(2)], int(match.group(3))
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _parse_number(raw: str) -> float:
+    """Convierte un número en formato español o anglosajón a float"""
+    raw = raw.replace(" ", "")
+    if "." in raw and "," in raw:
+        decimal = "." if raw.rfind(".") > raw.rfind(",") else ","
+    elif re.search(r"[.,]\d{3}$", raw) or re.search(r"[.,]\d{3}[.,]", raw):
+        decimal = None
+    elif "," in raw or "." in raw:
+        decimal = "," if "," in raw else "."
+    else:
+        decimal = None
+    thousands = {".", ","} - {decimal}
+    for sep in thousands:
+        raw = raw.replace(sep, "")
+    if decimal:
+        raw = raw.replace(decimal, ".")
+    return float(raw)
+
+
+def parse_amount(text: Optional[str]) -> Tuple[Optional[float], Optional[str], Optional[str]]:
+    """
+    Extrae importe, moneda (ISO 4217) y periodicidad de una respuesta libre
+
+    Returns:
+        Tupla (importe, moneda, periodicidad); cada elemento puede ser None
+    """
+    text = _clean(text)
+    if not text:
+        return None, None, None
+
+    # Preferir el número más cercano a un símbolo o nombre de moneda
+    currency, position = None, None
+    for code, pattern in MONEDAS:
+        match = pattern.search(text)
+        if match and (position is None or match.start() < position):
+            currency, position = code, match.start()
+
+    candidates = [m for m in AMOUNT.finditer(text) if not re.match(r"^(19|20)\d{2}$", m.group())]
+    amount = None
+    if candidates:
+        if position is not None:
+            best = min(candidates, key=lambda m: min(abs(m.end() - position), abs(m.start() - position)))
+        else:
+            best = max(candidates, key=lambda m: len(m.group()))
+        try:
+            amount = _parse_number(best.group())
+        except ValueError:
+            amount = None
+
+    period = None
+    for name, pattern in PERIODICIDADES:
+        if pattern.search(text):
+            period = name
+            break
+    if amount is not None and period is None:
+        period = "total"
+    return amount, currency, period
+
+
+def parse_duration_months(text: Optional[str]) -> Optional[int]:
+    """Extrae la duración en meses ("12 meses", "SEIS (6) MESES", "2 años")"""
+    match = DURATION.search(_clean(text))
+    if not match:
+        return None
+    quantity, unit = match.group(1).lower(), match.group(2).lower()
+    value = int(quantity) if quantity.isdigit() else NUMEROS[quantity]
+    return max(1, round(value * DURATION_UNITS[unit[0]]))
+
+
+def add_months(start: date, months: int) -> date:
+    """Suma meses a una fecha ajustando al último día del mes si es necesario"""
+    month_index = start.month - 1 + months
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    for day in (start.day, 30, 29, 28):
+        try:
+            return date(year, month, day)
+        except ValueError:
+            continue
+
+
+def total_value(amount: Optional[float], period: Optional[str],
+                months: Optional[int]) -> Optional[float]:
+    """
+    Valor total del contrato a partir del importe, su periodicidad y la duración
+
+    Un importe periódico sin duración conocida no tiene valor total (None).
+    """
+    if amount is None:
+        return None
+    if period == "total":
+        return amount
+    if period in MESES_POR_PERIODO and months:
+        return round(amount * months / MESES_POR_PERIODO[period], 2)
+    return None
+
+
+def normalize_results(results: Dict) -> Dict:
+    """
+    Convierte el diccionario de resultados de main() en una fila tipada
+
+    Args:
+        results: Resultados con "informacion_extraida", "resumen", etc.
+
+    Returns:
+        Diccionario con las columnas de la tabla contratos
+    """
+    info = results.get("informacion_extraida", {})
+    signed = parse_date(info.get("fecha_contrato"))
+    months = parse_duration_months(info.get("duracion"))
+    amount, currency, period = parse_amount(info.get("valor_economico"))
+    expires = add_months(signed, months) if signed and months else None
+    metadata = {k: v for k, v in results.items()
+                if k not in ("informacion_extraida", "resumen", "analisis_riesgos")}
+
+    return {
+        "documento": results.get("archivo_procesado", ""),
+        "fecha_analisis": results.get("fecha_analisis") or datetime.now().isoformat(),
+        "modelo": results.get("modelo"),
+        "tipo_contrato": (_clean_field(info.get("tipo_contrato")) or "").lower() or None,
+        "empresa_principal": _clean_field(info.get("empresa_principal")),
+        "contraparte": _clean_field(info.get("contraparte")),
+        "fecha_contrato": signed.isoformat() if signed else None,
+        "fecha_vencimiento": expires.isoformat() if expires else None,
+        "duracion_meses": months,
+        "importe": amount,
+        "moneda": currency,
+        "periodicidad": period,
+        "valor_total": total_value(amount, period, months),
+        "lugar_firma": _clean_field(info.get("lugar_firma")),
+        "respuestas": json.dumps(info, ensure_ascii=False),
+        "resumen": results.get("resumen"),
+        "analisis_riesgos": results.get("analisis_riesgos"),
+        "metadatos": json.dumps(metadata, ensure_ascii=False)
+    }
+
+
+class ResultsStore:
+    """
+    Almacén SQLite de resultados de análisis (una fila por contrato)
+    """
+
+    def __init__(self, db_path: str = "resultados.db"):
+        """
+        Abre (o crea) la base de datos de resultados
+
+        Args:
+            db_path: Ruta al archivo SQLite
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.conn.executescript(INDEXES)
+
+    def _migrate(self):
+        """Añade las columnas nuevas a bases de datos creadas con versiones anteriores"""
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(contratos)")}
+        if "valor_total" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE contratos ADD COLUMN valor_total REAL")
+                rows = self.conn.execute(
+                    "SELECT id, importe, periodicidad, duracion_meses FROM contratos"
+                ).fetchall()
+                self.conn.executemany(
+                    "UPDATE contratos SET valor_total = ? WHERE id = ?",
+                    [(total_value(r["importe"], r["periodicidad"], r["duracion_meses"]), r["id"])
+                     for r in rows]
+                )
+
+    def save(self, results: Dict) -> None:
+        """Guarda (o reemplaza) los resultados de un contrato"""
+        self.save_many([results])
+
+    def save_many(self, results_list: Iterable[Dict]) -> int:
+        """
+        Guarda varios resultados en una sola transacción
+
+        Returns:
+            Número de contratos guardados
+        """
+        rows = [normalize_results(r) for r in results_list]
+        if not rows:
+            return 0
+        columns = list(rows[0])
+        updates = ", ".join(f"{c}=excluded.{c}" for c in columns if c != "documento")
+        sql = (f"INSERT INTO contratos ({', '.join(columns)}) "
+               f"VALUES ({', '.join(':' + c for c in columns)}) "
+               f"ON CONFLICT(documento) DO UPDATE SET {updates}")
+        with self._lock, self.conn:
+            self.conn.executemany(sql, rows)
+        return len(rows)
+
+    def get(self, documento: str) -> Optional[Dict]:
+        """Devuelve la fila de un contrato, o None si no existe"""
+        row = self.conn.execute(
+            "SELECT * FROM contratos WHERE documento = ?", (documento,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def value_by_counterparty(self, currency: Optional[str] = None) -> List[Dict]:
+        """
+        Suma el valor total de los contratos agrupado por contraparte y moneda
+
+        Los importes periódicos se suman ya multiplicados por la duración del
+        contrato (valor_total); los que no tienen duración conocida no cuentan.
+
+        Args:
+            currency: Filtrar por moneda (código ISO, p. ej. "EUR")
+        """
+        sql = ("SELECT contraparte, moneda, SUM(valor_total) AS total, COUNT(*) AS contratos "
+               "FROM contratos WHERE valor_total IS NOT NULL")
+        params = []
+        if currency:
+            sql += " AND moneda = ?"
+            params.append(currency)
+        sql += " GROUP BY contraparte, moneda ORDER BY total DESC"
+        return [dict(r) for r in self.conn.execute(sql, params)]
+
+    def expiring_between(self, start: date, end: date) -> List[Dict]:
+        """Contratos cuyo vencimiento está entre dos fechas (ambas incluidas)"""
+        rows = self.conn.execute(
+            "SELECT documento, contraparte, fecha_vencimiento, importe, moneda, valor_total "
+            "FROM contratos WHERE fecha_vencimiento BETWEEN ? AND ? "
+            "ORDER BY fecha_vencimiento",
+            (start.isoformat(), end.isoformat())
+        )
+        return [dict(r) for r in rows]
+
+    def expiring_next_quarter(self, today: Optional[date] = None) -> List[Dict]:
+        """Contratos que vencen en el próximo trimestre natural"""
+        today = today or date.today()
+        quarter_start = date(today.year, 3 * ((today.month - 1) // 3) + 1, 1)
+        start = add_months(quarter_start, 3)
+        end = date.fromordinal(add_months(start, 3).toordinal() - 1)
+        return self.expiring_between(start, end)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,336 @@
+"""
+Modo jerárquico (map-reduce) para resumir y analizar riesgos de contratos extensos
+
+Divide el documento en rangos de cláusulas (texto) o de páginas (PDF),
+analiza cada sección en paralelo y fusiona los resultados parciales en el
+mismo formato que el análisis de una sola llamada. Los resultados de cada
+sección se cachean en disco, de forma que un reintento solo repite las
+secciones que fallaron.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+# Tamaño máximo (en caracteres) de cada sección enviada al modelo
+MAX_SECTION_CHARS = 40000
+
+# Media mínima de caracteres extraídos por página para considerar que un PDF
+# tiene capa de texto (los escaneados devuelven páginas vacías o casi vacías)
+MIN_CHARS_PER_PAGE = 20
+
+# Encabezados habituales de cláusulas y anexos en contratos en español
+CLAUSE_HEADING = re.compile(
+    r"^[ \t]*(?:"
+    r"(?:PRIMER[AO]|SEGUND[AO]|TERCER[AO]|CUART[AO]|QUINT[AO]|SEXT[AO]|"
+    r"S[ÉE]PTIM[AO]|OCTAV[AO]|NOVEN[AO]|D[ÉE]CIM\w*|UND[ÉE]CIM[AO]|DUOD[ÉE]CIM[AO])\b"
+    r"|CL[ÁA]USULA\b|ANEXO\b|AP[ÉE]NDICE\b"
+    r"|\d{1,3}\.\s+[A-ZÁÉÍÓÚÑ]"
+    r")",
+    re.MULTILINE
+)
+
+SECTION_PROMPTS = {
+    "resumen": """
+        La siguiente es la sección "{rango}" de un contrato extenso.
+        Resume de forma concisa, en español, todo lo que aparezca en ella sobre:
+        tipo y objeto del contrato, partes, términos económicos, duración y plazos,
+        obligaciones de cada parte y cláusulas críticas.
+        Si la sección no trata alguno de estos puntos, omítelo.
+
+        --- SECCIÓN ---
+        {texto}
+        """,
+    "riesgos": """
+        La siguiente es la sección "{rango}" de un contrato extenso.
+        Identifica, en español, los riesgos legales o comerciales, cláusulas
+        desfavorables, ambigüedades, penalizaciones y condiciones de terminación
+        que aparezcan en ella. Cita la cláusula o página correspondiente.
+        Si no hay nada relevante, responde "Sin puntos de atención".
+
+        --- SECCIÓN ---
+        {texto}
+        """
+}
+
+# Prompt para fusionar resultados parciales en un nivel intermedio
+MERGE_PROMPT = """
+        Fusiona los siguientes análisis parciales de un mismo contrato en un único
+        texto, sin perder datos relevantes ni referencias a cláusulas o páginas.
+        Elimina las repeticiones.
+
+        {parciales}
+        """
+
+# Prompt final: reutiliza la consulta original para mantener el formato de salida
+REDUCE_PROMPT = """
+        {consulta}
+
+        El contrato es demasiado extenso para analizarlo de una sola vez y se ha
+        procesado por secciones. Basa tu respuesta únicamente en los siguientes
+        análisis parciales:
+
+        {parciales}
+        """
+
+
+def split_text_into_sections(text: str, max_chars: int = MAX_SECTION_CHARS) -> List[Dict]:
+    """
+    Divide un texto en secciones formadas por cláusulas completas
+
+    Args:
+        text: Texto completo del contrato
+        max_chars: Tamaño máximo de cada sección
+
+    Returns:
+        Lista de secciones ({"id", "rango", "texto"})
+    """
+    starts = [m.start() for m in CLAUSE_HEADING.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    blocks = [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)])]
+
+    # Las cláusulas que por sí solas superan el límite se parten por párrafos
+    pieces = []
+    for block in blocks:
+        if len(block) <= max_chars:
+            pieces.append(block)
+            continue
+        current = ""
+        for paragraph in re.split(r"(?<=\n)\s*\n", block):
+            while len(paragraph) > max_chars:
+                pieces.append(paragraph[:max_chars])
+                paragraph = paragraph[max_chars:]
+            if current and len(current) + len(paragraph) > max_chars:
+                pieces.append(current)
+                current = ""
+            current += paragraph
+        if current:
+            pieces.append(current)
+
+    # Agrupar cláusulas consecutivas hasta llenar cada sección
+    groups = []
+    for piece in pieces:
+        if not piece.strip():
+            continue
+        if groups and len(groups[-1]["texto"]) + len(piece) <= max_chars:
+            groups[-1]["texto"] += piece
+            groups[-1]["ultima"] = piece
+        else:
+            groups.append({"texto": piece, "primera": piece, "ultima": piece})
+
+    sections = []
+    for i, group in enumerate(groups, 1):
+        first = _heading(group["primera"])
+        last = _heading(group["ultima"])
+        sections.append({
+            "id": f"s{i:03d}",
+            "rango": first if first == last else f"{first} → {last}",
+            "texto": group["texto"]
+        })
+    return sections
+
+
+def split_pdf_into_sections(pdf_path: str, pages_per_section: int = 10,
+                            max_chars: int = MAX_SECTION_CHARS) -> List[Dict]:
+    """
+    Divide un PDF en rangos de páginas extrayendo su texto localmente
+
+    Args:
+        pdf_path: Ruta al archivo PDF
+        pages_per_section: Número máximo de páginas por sección
+        max_chars: Tamaño máximo de cada sección
+
+    Returns:
+        Lista de secciones ({"id", "rango", "texto"}); vacía si el PDF no
+        tiene capa de texto (p. ej. un documento escaneado)
+    """
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        raise RuntimeError("El modo jerárquico para PDF requiere PyPDF2: pip install PyPDF2")
+
+    reader = PdfReader(pdf_path)
+    pages = [page.extract_text() or "" for page in reader.pages]
+    if sum(len(page.strip()) for page in pages) < MIN_CHARS_PER_PAGE * max(1, len(pages)):
+        return []
+
+    sections = []
+    start = 0
+    while start < len(pages):
+        end = start
+        text = ""
+        # Cerrar la sección al llegar al número de páginas o al tamaño máximo
+        while end < len(pages) and end - start < pages_per_section:
+            if text and len(text) + len(pages[end]) > max_chars:
+                break
+            text += f"\n[Página {end + 1}]\n{pages[end]}"
+            end += 1
+        rango = f"página {start + 1}" if end - start == 1 else f"páginas {start + 1}-{end}"
+        sections.append({"id": f"s{len(sections) + 1:03d}", "rango": rango, "texto": text})
+        start = end
+    return sections
+
+
+def load_sections(path: str, max_chars: int = MAX_SECTION_CHARS) -> List[Dict]:
+    """
+    Carga un documento local y lo divide en secciones según su formato
+
+    Args:
+        path: Ruta al documento (PDF o texto)
+        max_chars: Tamaño máximo de cada sección
+
+    Returns:
+        Lista de secciones
+    """
+    if Path(path).suffix.lower() == ".pdf":
+        return split_pdf_into_sections(path, max_chars=max_chars)
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return split_text_into_sections(f.read(), max_chars)
+
+
+def _heading(text: str) -> str:
+    """Devuelve la primera línea no vacía de un bloque, recortada"""
+    for line in text.splitlines():
+        if line.strip():
+            return line.strip()[:60]
+    return "(vacío)"
+
+
+class SectionCache:
+    """
+    Caché en disco de resultados por sección
+
+    La clave incluye el modelo, el prompt y el texto de la sección, así que
+    cualquier cambio en alguno de ellos invalida la entrada.
+    """
+
+    def __init__(self, directory: str = ".cache_secciones"):
+        self.directory = Path(directory)
+
+    def key(self, *parts: str) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.directory / f"{key}.json"
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)["resultado"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, result: str):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{key}.json"
+        # Temporal único por escritura: varios hilos pueden guardar la misma
+        # sección a la vez (p. ej. un anexo idéntico en dos contratos)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"resultado": result}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def run_hierarchical(sections: List[Dict], query: str, kind: str,
+                     generate: Callable[[str], str], cache: SectionCache,
+                     model: str = "", max_workers: int = 4,
+                     max_chars: int = MAX_SECTION_CHARS) -> str:
+    """
+    Ejecuta el análisis map-reduce sobre las secciones de un documento
+
+    Args:
+        sections: Secciones obtenidas con load_sections
+        query: Consulta original (define el formato de la respuesta final)
+        kind: Tipo de análisis por sección ("resumen" o "riesgos")
+        generate: Función que envía un prompt al modelo y devuelve el texto
+        cache: Caché de resultados por sección
+        model: Nombre del modelo (forma parte de la clave de caché)
+        max_workers: Número de secciones analizadas en paralelo
+        max_chars: Tamaño máximo de cada lote en la fase de reducción
+
+    Returns:
+        Resultado final en el mismo formato que la consulta original
+
+    Raises:
+        RuntimeError: Si no hay secciones o alguna sección falla (las correctas
+                      quedan en caché)
+    """
+    if not sections:
+        raise RuntimeError("El documento no tiene texto extraíble para el modo jerárquico")
+    prompt_template = SECTION_PROMPTS[kind]
+
+    def analyze(section: Dict) -> str:
+        prompt = prompt_template.format(rango=section["rango"], texto=section["texto"])
+        key = cache.key(model, prompt)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        result = generate(prompt)
+        cache.put(key, result)
+        return result
+
+    # Fase map: secciones en paralelo
+    print(f"🧩 Analizando {len(sections)} secciones en paralelo...")
+    partials = {}
+    failures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(analyze, section): section for section in sections}
+        for future, section in futures.items():
+            try:
+                partials[section["id"]] = future.result()
+                print(f"  ✓ {section['id']} ({section['rango']})")
+            except Exception as e:
+                failures.append(f"{section['id']} ({section['rango']}): {str(e)}")
+                print(f"  ✗ {section['id']} ({section['rango']}): {str(e)}")
+
+    if failures:
+        raise RuntimeError(
+            f"{len(failures)} de {len(sections)} secciones fallaron; "
+            f"reintenta para repetir solo esas secciones. " + "; ".join(failures)
+        )
+
+    blocks = [
+        f"### Sección {section['id']} ({section['rango']})\n{partials[section['id']]}"
+        for section in sections
+    ]
+
+    # Fase reduce: fusionar por niveles mientras el conjunto no quepa en una llamada
+    level = 0
+    while len(blocks) > 1 and sum(len(b) for b in blocks) > max_chars:
+        level += 1
+        batches = []
+        for block in blocks:
+            if batches and len(batches[-1]) > 1 and sum(len(b) for b in batches[-1]) + len(block) > max_chars:
+                batches.append([])
+            if not batches:
+                batches.append([])
+            batches[-1].append(block)
+        print(f"🔗 Fusionando nivel {level}: {len(blocks)} → {len(batches)} bloques")
+        merged = []
+        for i, batch in enumerate(batches, 1):
+            prompt = MERGE_PROMPT.format(parciales="\n\n".join(batch))
+            key = cache.key(model, prompt)
+            result = cache.get(key)
+            if result is None:
+                result = generate(prompt)
+                cache.put(key, result)
+            merged.append(f"### Bloque {level}.{i}\n{result}")
+        blocks = merged
+
+    return generate(REDUCE_PROMPT.format(consulta=query.strip(), parciales="\n\n".join(blocks)))
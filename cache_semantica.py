@@ -0,0 +1,250 @@
+"""
+Caché semántica de respuestas por documento
+
+Reconoce preguntas equivalentes redactadas de forma distinta comparando
+vectores TF-IDF de n-gramas de caracteres, calculados localmente sin ningún
+servicio externo de embeddings. Como los n-gramas no distinguen una negación,
+un antónimo o un matiz de una paráfrasis ("cumplimiento" / "incumplimiento",
+"el plazo" / "el plazo de pago"), además se exige que ambas preguntas tengan
+la misma polaridad y las mismas palabras de contenido, salvo una lista corta
+de términos equivalentes. Cada consulta registra la similitud con la pregunta
+más parecida para poder auditar y ajustar el umbral.
+"""
+
+import hashlib
+import json
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+# Palabras vacías y fórmulas de pregunta frecuentes en consultas sobre contratos
+STOPWORDS = {
+    "a", "al", "algun", "alguna", "algunas", "alguno", "algunos", "con", "como",
+    "cual", "cuales", "de", "del", "el", "ella", "en", "es", "esta", "este",
+    "esto", "existe", "existen", "hay", "la", "las", "lo", "los", "mas", "o",
+    "para", "por", "que", "se", "si", "sobre", "su", "sus", "un", "una", "unas",
+    "uno", "unos", "y", "caso", "establece", "establecen", "contempla",
+    "contemplan", "preve", "preven", "recoge", "recogen", "menciona",
+    "mencionan", "indica", "indican", "dice", "son", "estan", "tiene", "tienen"
+}
+
+# Negaciones: dos preguntas solo son equivalentes si contienen las mismas
+NEGATIONS = {"no", "ni", "sin", "nunca", "jamas", "tampoco", "ningun", "ninguna", "ninguno"}
+
+# Términos que se consideran equivalentes (en singular); se sustituyen por su
+# forma canónica antes de comparar, y cualquier otra palabra distinta descarta
+# la coincidencia
+EQUIVALENTS = {
+    "sucede": "consecuencia", "pasa": "consecuencia", "ocurre": "consecuencia",
+    "consecuencia": "consecuencia", "penalizacion": "consecuencia",
+    "penalidad": "consecuencia", "sancion": "consecuencia"
+}
+
+
+def _words(question: str) -> List[str]:
+    """Palabras en minúsculas, sin tildes ni signos de puntuación"""
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def _stem(word: str) -> str:
+    """Singular aproximado (penalizaciones → penalizacion, garantias → garantia)"""
+    if len(word) > 5 and word.endswith("es") and word[-3] not in "aeiou":
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def _canonical(word: str) -> str:
+    """Término canónico de una palabra de la lista de equivalentes, o la propia palabra"""
+    return EQUIVALENTS.get(_stem(word), word)
+
+
+def _normalize(question: str) -> str:
+    """Minúsculas, sin tildes, sin signos de puntuación ni palabras vacías"""
+    return " ".join(_canonical(w) for w in _words(question) if w not in STOPWORDS)
+
+
+def _signature(question: str) -> Tuple[frozenset, frozenset]:
+    """Negaciones y palabras de contenido (en singular y canónicas) de una pregunta"""
+    words = [w for w in _words(question) if w not in STOPWORDS]
+    negations = frozenset(w for w in words if w in NEGATIONS)
+    content = frozenset(
+        _stem(_canonical(w)) for w in words if w not in NEGATIONS
+    )
+    return negations, content
+
+
+def _same_meaning(a: Tuple[frozenset, frozenset], b: Tuple[frozenset, frozenset]) -> bool:
+    """
+    Comprobación a nivel de palabra que complementa la similitud de n-gramas
+
+    Exige la misma polaridad y las mismas palabras de contenido: una palabra
+    de más en cualquiera de las dos preguntas ("¿Quién paga los gastos?" /
+    "¿Quién paga los gastos de envío?") descarta la coincidencia, salvo los
+    términos equivalentes de EQUIVALENTS.
+    """
+    (neg_a, words_a), (neg_b, words_b) = a, b
+    return neg_a == neg_b and bool(words_a) and words_a == words_b
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Huella SHA-256 del contenido de un archivo
+
+    Las respuestas se indexan por contenido y no por ruta: si el archivo se
+    edita o se sustituye, las respuestas guardadas dejan de servirse.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SemanticAnswerCache:
+    """
+    Caché de respuestas indexada por similitud de la pregunta
+    """
+
+    def __init__(self, threshold: float = 0.55, path: Optional[str] = None,
+                 log_path: Optional[str] = None, ngram_range: Tuple[int, int] = (3, 5)):
+        """
+        Args:
+            threshold: Similitud coseno mínima (0-1) para servir una respuesta de caché
+            path: Archivo JSONL donde persistir las respuestas entre ejecuciones
+            log_path: Archivo JSONL donde registrar cada búsqueda y su similitud
+            ngram_range: Longitudes mínima y máxima de los n-gramas de caracteres
+        """
+        self.threshold = threshold
+        self.path = path
+        self.log_path = log_path
+        self.ngram_range = ngram_range
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, List[Dict]] = {}
+        self._df = Counter()
+        self._total = 0
+        self._lock = threading.Lock()
+        if path and Path(path).exists():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._add(entry["documento"], entry["pregunta"], entry["respuesta"])
+
+    def _features(self, question: str) -> Counter:
+        """N-gramas de caracteres de cada palabra (con espacios de borde)"""
+        low, high = self.ngram_range
+        features = Counter()
+        for word in _normalize(question).split():
+            padded = f" {word} "
+            for n in range(low, high + 1):
+                for i in range(len(padded) - n + 1):
+                    features[padded[i:i + n]] += 1
+        return features
+
+    def _weights(self, features: Counter, query: Counter) -> Tuple[Dict[str, float], float]:
+        """
+        Pesos TF-IDF y su norma
+
+        El IDF (suavizado) se calcula sobre las preguntas en caché más la
+        consulta, para que la similitud sea la misma en ambos sentidos.
+        """
+        weights = {}
+        for gram, count in features.items():
+            df = self._df[gram] + (1 if gram in query else 0)
+            idf = math.log((2 + self._total) / (1 + df)) + 1
+            weights[gram] = (1 + math.log(count)) * idf
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        return weights, norm
+
+    def _add(self, document: str, question: str, answer: str):
+        features = self._features(question)
+        self._entries.setdefault(document, []).append({
+            "pregunta": question, "respuesta": answer, "features": features,
+            "firma": _signature(question)
+        })
+        self._df.update(features.keys())
+        self._total += 1
+
+    def lookup(self, document: str, question: str) -> Optional[Tuple[str, float, str]]:
+        """
+        Busca una respuesta a una pregunta equivalente sobre el mismo documento
+
+        Args:
+            document: Identificador del documento
+            question: Pregunta formulada
+
+        Returns:
+            Tupla (respuesta, similitud, pregunta_original) si supera el umbral
+            y la comprobación por palabras, o None
+        """
+        with self._lock:
+            best, best_score, rejected = None, 0.0, 0
+            entries = self._entries.get(document, [])
+            if entries:
+                features = self._features(question)
+                query, query_norm = self._weights(features, features)
+                signature = _signature(question)
+                for entry in entries:
+                    weights, norm = self._weights(entry["features"], features)
+                    if not norm or not query_norm:
+                        continue
+                    dot = sum(w * weights.get(g, 0.0) for g, w in query.items())
+                    score = dot / (norm * query_norm)
+                    if score >= self.threshold and not _same_meaning(signature, entry["firma"]):
+                        rejected += 1  # Parecida, pero negada, antónima o sobre otra cosa
+                        continue
+                    if score > best_score:
+                        best, best_score = entry, score
+            hit = best is not None and best_score >= self.threshold
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._log(document, question, best["pregunta"] if best else None, best_score, hit, rejected)
+        if hit:
+            return best["respuesta"], best_score, best["pregunta"]
+        return None
+
+    def store(self, document: str, question: str, answer: str):
+        """Guarda la respuesta a una pregunta sobre un documento"""
+        with self._lock:
+            self._add(document, question, answer)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"documento": document, "pregunta": question,
+                                        "respuesta": answer}, ensure_ascii=False) + "\n")
+
+    def _log(self, document: str, question: str, match: Optional[str], score: float,
+             hit: bool, rejected: int = 0):
+        if not self.log_path:
+            return
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "fecha": datetime.now().isoformat(),
+                "documento": document,
+                "pregunta": question,
+                "coincidencia": match,
+                "similitud": round(score, 4),
+                "umbral": self.threshold,
+                "acierto": hit,
+                "descartadas_por_palabras": rejected
+            }, ensure_ascii=False) + "\n")
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "aciertos": self.hits,
+            "fallos": self.misses,
+            "tasa_acierto": round(self.hits / total, 3) if total else 0.0
+        }
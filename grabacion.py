@@ -0,0 +1,321 @@
+"""
+Grabación y reproducción de las interacciones con Gemini
+
+En modo grabación se envuelve el cliente real y cada subida, consulta de
+estado (files.get) y generate_content se guarda con su duración en un
+"cassette" JSONL comprimido. En modo reproducción las respuestas se sirven
+desde el cassette, indexadas por el contenido de la petición, sin red ni API
+key, a la velocidad grabada o lo más rápido posible. Así se pueden comparar
+versiones del pipeline con tiempos y número de llamadas reproducibles.
+
+Las llamadas que fallan (429, 5xx...) también se graban con el tipo y el
+mensaje del error, y se vuelven a lanzar en la reproducción en el mismo orden,
+para que los reintentos de una traza real se repitan igual.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class ReplayMissError(KeyError):
+    """La petición no aparece en el cassette"""
+
+
+class RecordedError(Exception):
+    """Error grabado en el cassette y relanzado durante la reproducción"""
+
+    def __init__(self, data: Dict):
+        super().__init__(data.get("mensaje", ""))
+        self.tipo = data.get("tipo")
+        # Mismos atributos que los errores de la API, para quien mire el código HTTP
+        self.code = data.get("codigo")
+        self.status_code = self.code
+
+
+def _describe_error(error: Exception) -> Dict:
+    """Tipo, mensaje y código HTTP (si lo hay) de un error de la API"""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return {
+        "tipo": type(error).__name__,
+        "mensaje": str(error),
+        "codigo": code if isinstance(code, int) else None
+    }
+
+
+class _Recorded:
+    """Objeto de respuesta reconstruido a partir del cassette"""
+
+    def __init__(self, data: Dict):
+        self.__dict__.update(data)
+
+    def __repr__(self):
+        return f"Recorded({self.__dict__})"
+
+
+def _file_fields(file_obj) -> Dict:
+    """Campos relevantes de un archivo de la API"""
+    fields = {}
+    for attr in ("name", "display_name", "uri", "mime_type", "size_bytes", "state"):
+        value = getattr(file_obj, attr, None)
+        if value is not None:
+            # FileState es un enum; se guarda su valor en texto
+            fields[attr] = getattr(value, "value", value) if attr == "state" else value
+    return fields
+
+
+def _describe_content(item) -> Any:
+    """Representación estable de un elemento de contents para la clave"""
+    if isinstance(item, str):
+        return item
+    if isinstance(item, (list, tuple)):
+        return [_describe_content(i) for i in item]
+    name = getattr(item, "name", None)
+    if name:
+        return {"archivo": name}
+    return repr(item)
+
+
+def _describe_config(config) -> Any:
+    if config is None:
+        return None
+    if hasattr(config, "model_dump"):
+        return config.model_dump(exclude_none=True, mode="json")
+    if isinstance(config, dict):
+        return config
+    return {k: v for k, v in vars(config).items() if v is not None}
+
+
+def _key(kind: str, payload: Any) -> str:
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{kind}\0{data}".encode("utf-8")).hexdigest()
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def upload_key(file, config) -> str:
+    display_name = (config or {}).get("display_name") if isinstance(config, dict) else None
+    content = _file_digest(str(file)) if isinstance(file, (str, Path)) else repr(file)
+    return _key("upload", {"contenido": content, "display_name": display_name})
+
+
+def get_key(name: str) -> str:
+    return _key("get", {"name": name})
+
+
+def generate_key(model: str, contents, config) -> str:
+    return _key("generate", {
+        "model": model,
+        "contents": _describe_content(contents),
+        "config": _describe_config(config)
+    })
+
+
+class _CallStats:
+    """Contadores de llamadas y tiempo total de una sesión"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.seconds = Counter()
+        self.started = time.time()
+
+    def add(self, kind: str, elapsed: float):
+        self.calls[kind] += 1
+        self.seconds[kind] += elapsed
+
+    def summary(self) -> Dict:
+        return {
+            "llamadas": dict(self.calls),
+            "segundos_api": {k: round(v, 3) for k, v in self.seconds.items()},
+            "segundos_totales": round(time.time() - self.started, 3)
+        }
+
+
+class RecordingClient:
+    """
+    Envuelve un genai.Client y graba cada interacción en un cassette
+    """
+
+    def __init__(self, client, cassette_path: str):
+        """
+        Args:
+            client: Cliente real de google-genai
+            cassette_path: Ruta del cassette (se sobrescribe)
+        """
+        self._client = client
+        self.cassette_path = cassette_path
+        self.stats = _CallStats()
+        self._lock = threading.Lock()
+        Path(cassette_path).parent.mkdir(parents=True, exist_ok=True)
+        # Un único flujo gzip para todo el cassette; close() lo cierra al terminar
+        self._file = gzip.open(cassette_path, "wt", encoding="utf-8")
+        self.files = _RecordingFiles(self)
+        self.models = _RecordingModels(self)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _call(self, kind: str, key: str, func, describe):
+        """Ejecuta una llamada y la graba, tanto si responde como si falla"""
+        start = time.time()
+        try:
+            result = func()
+        except Exception as e:
+            self._record(kind, key, None, time.time() - start, error=_describe_error(e))
+            raise
+        self._record(kind, key, describe(result), time.time() - start)
+        return result
+
+    def _record(self, kind: str, key: str, response: Optional[Dict], elapsed: float,
+                error: Optional[Dict] = None):
+        self.stats.add(kind, elapsed)
+        entry = {"tipo": kind, "clave": key, "segundos": round(elapsed, 4), "respuesta": response}
+        if error:
+            entry["error"] = error
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        """Cierra el cassette; sin cerrarlo le falta el final del flujo gzip"""
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class _RecordingFiles:
+    def __init__(self, owner: RecordingClient):
+        self._owner = owner
+
+    def upload(self, file, config=None, **kwargs):
+        return self._owner._call(
+            "upload", upload_key(file, config),
+            lambda: self._owner._client.files.upload(file=file, config=config, **kwargs),
+            _file_fields
+        )
+
+    def get(self, name: str, **kwargs):
+        return self._owner._call(
+            "get", get_key(name),
+            lambda: self._owner._client.files.get(name=name, **kwargs),
+            _file_fields
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._owner._client.files, name)
+
+
+class _RecordingModels:
+    def __init__(self, owner: RecordingClient):
+        self._owner = owner
+
+    def generate_content(self, model: str, contents, config=None, **kwargs):
+        return self._owner._call(
+            "generate", generate_key(model, contents, config),
+            lambda: self._owner._client.models.generate_content(
+                model=model, contents=contents, config=config, **kwargs
+            ),
+            self._describe
+        )
+
+    @staticmethod
+    def _describe(result) -> Dict:
+        usage = getattr(result, "usage_metadata", None)
+        response = {"text": result.text}
+        if usage is not None:
+            response["usage_metadata"] = {
+                k: getattr(usage, k, None)
+                for k in ("prompt_token_count", "candidates_token_count", "total_token_count")
+            }
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._owner._client.models, name)
+
+
+class ReplayClient:
+    """
+    Cliente que sirve las respuestas grabadas en un cassette, sin red
+
+    Las peticiones se buscan por contenido. Si una misma petición se grabó
+    varias veces (p. ej. sondeos de files.get o reintentos tras un error), las
+    respuestas se devuelven en el orden grabado y, agotadas, se repite la
+    última. Los errores grabados se lanzan como RecordedError.
+    """
+
+    def __init__(self, cassette_path: str, realtime: bool = False):
+        """
+        Args:
+            cassette_path: Ruta del cassette grabado
+            realtime: Reproducir con la duración grabada de cada llamada;
+                      si es False se responde lo más rápido posible
+        """
+        self.cassette_path = cassette_path
+        self.realtime = realtime
+        # Sin tiempo real tampoco tiene sentido esperar entre sondeos de estado
+        self.skip_waits = not realtime
+        self.stats = _CallStats()
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._recorded: Dict[str, List[Dict]] = {}
+        self._served = Counter()
+        with gzip.open(cassette_path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if line.strip() and line.endswith("\n"):
+                        entry = json.loads(line)
+                        self._recorded.setdefault(entry["clave"], []).append(entry)
+            except EOFError:
+                pass  # Grabación interrumpida sin close(): vale todo lo volcado con flush()
+        self.files = _ReplayFiles(self)
+        self.models = _ReplayModels(self)
+
+    def _serve(self, kind: str, key: str, description: str) -> Dict:
+        with self._lock:
+            entries = self._recorded.get(key)
+            if not entries:
+                self.misses += 1
+                raise ReplayMissError(f"Petición no grabada en el cassette ({kind}): {description[:120]}")
+            entry = entries[min(self._served[key], len(entries) - 1)]
+            self._served[key] += 1
+        if self.realtime:
+            time.sleep(entry["segundos"])
+        self.stats.add(kind, entry["segundos"] if self.realtime else 0.0)
+        if entry.get("error"):
+            raise RecordedError(entry["error"])
+        return entry["respuesta"]
+
+
+class _ReplayFiles:
+    def __init__(self, owner: ReplayClient):
+        self._owner = owner
+
+    def upload(self, file, config=None, **kwargs):
+        return _Recorded(self._owner._serve("upload", upload_key(file, config), str(file)))
+
+    def get(self, name: str, **kwargs):
+        return _Recorded(self._owner._serve("get", get_key(name), name))
+
+
+class _ReplayModels:
+    def __init__(self, owner: ReplayClient):
+        self._owner = owner
+
+    def generate_content(self, model: str, contents, config=None, **kwargs):
+        key = generate_key(model, contents, config)
+        response = dict(self._owner._serve("generate", key, str(_describe_content(contents))))
+        if response.get("usage_metadata"):
+            response["usage_metadata"] = _Recorded(response["usage_metadata"])
+        return _Recorded(response)
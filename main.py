@@ -8,29 +8,120 @@ from google import genai
 from google.genai import types
 import time
 import os
+import copy
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 import json
 from datetime import datetime
 from dotenv import load_dotenv
 
+from almacen_resultados import ResultsStore
+from analisis_jerarquico import SectionCache, load_sections, run_hierarchical
+from cache_semantica import SemanticAnswerCache, file_fingerprint
+from grabacion import RecordingClient, ReplayClient
+from normalizacion import NormalizedText, normalize_file
+from planificador import PriorityScheduler
+from pool_claves import KeyPool, PooledClient
+from subida_reanudable import ResumableUploader
+
+
+SUMMARY_QUERY = """
+        Genera un resumen ejecutivo profesional de este contrato que incluya:
+        1. Tipo y objeto del contrato
+        2. Partes involucradas
+        3. Términos económicos principales
+        4. Duración y condiciones temporales
+        5. Obligaciones principales de cada parte
+        6. Cláusulas críticas o puntos de atención
+        
+        El resumen debe ser conciso pero completo, en español, y con un tono profesional.
+        """
+
+RISK_QUERY = """
+        Analiza este contrato e identifica:
+        1. Posibles riesgos legales o comerciales
+        2. Cláusulas que podrían ser desfavorables para alguna de las partes
+        3. Ambigüedades o puntos que necesitan aclaración
+        4. Penalizaciones o sanciones contempladas
+        5. Condiciones de terminación o rescisión
+        
+        Proporciona un análisis objetivo y profesional.
+        """
+
 
 class ContractAnalyzer:
     """
     Clase para analizar contratos PDF usando File Search de Gemini
     """
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: Union[str, List[str]]):
         """
         Inicializa el analizador con la API key de Google
         
         Args:
-            api_key: Tu API key de Google AI Studio
+            api_key: Tu API key de Google AI Studio (no se usa en modo replay).
+                     Varias claves (lista o separadas por comas) reparten la
+                     carga entre sus cuotas.
         """
-        # Configurar el cliente con la API key
-        self.client = genai.Client(api_key=api_key)
+        if isinstance(api_key, str):
+            api_keys = [key.strip() for key in api_key.split(",") if key.strip()]
+        else:
+            api_keys = list(api_key or [])
+        
+        # Grabación/reproducción de las llamadas a la API (CASSETTE_MODE=record|replay)
+        cassette_mode = os.getenv("CASSETTE_MODE", "").lower()
+        cassette_path = os.getenv("CASSETTE_PATH", "cassette.jsonl.gz")
+        chunk_size = int(os.getenv("UPLOAD_CHUNK_MB", "8")) * 1024 * 1024
+        upload_state_dir = os.getenv("UPLOAD_STATE_DIR", ".subidas")
+        
+        # Subida por fragmentos y reanudable para archivos grandes
+        self.resumable_uploader = None
+        self.resumable_threshold = int(os.getenv("RESUMABLE_UPLOAD_THRESHOLD_MB", "32")) * 1024 * 1024
+        
+        if cassette_mode == "replay":
+            realtime = os.getenv("CASSETTE_REALTIME", "false").lower() == "true"
+            self.client = ReplayClient(cassette_path, realtime=realtime)
+        elif len(api_keys) > 1 and not cassette_mode:
+            # Pool de claves: cada documento queda fijado a la clave que lo sube
+            pool = KeyPool(
+                api_keys,
+                rpm_limit=int(os.getenv("KEY_RPM_LIMIT", "60")),
+                tpm_limit=int(os.getenv("KEY_TPM_LIMIT", "0"))
+            )
+            self.client = PooledClient(pool, chunk_size, upload_state_dir)
+            self.resumable_uploader = self.client.resumable_uploader
+        else:
+            # Configurar el cliente con la API key
+            self.client = genai.Client(api_key=api_keys[0] if api_keys else None)
+            if cassette_mode == "record":
+                self.client = RecordingClient(self.client, cassette_path)
+            elif api_keys:
+                self.resumable_uploader = ResumableUploader(
+                    api_keys[0], chunk_size=chunk_size, state_dir=upload_state_dir
+                )
         self.uploaded_file = None
+        self.document_path = None
         self.model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+        self.section_cache = SectionCache(os.getenv("SECTION_CACHE_DIR", ".cache_secciones"))
+        self.normalized = None
+        # Planificador compartido por todas las llamadas al modelo
+        self.scheduler = PriorityScheduler(
+            int(os.getenv("SCHEDULER_MAX_CONCURRENCY", str(8 * max(1, len(api_keys)))))
+        )
+        self.priority = "standard"
+        self.tenant = None
+        # Propagar las excepciones en lugar de devolver el mensaje de error
+        # como respuesta (procesamiento por lotes)
+        self.raise_errors = False
+        # Caché de respuestas para preguntas equivalentes (opcional)
+        self.answer_cache = None
+        self._fingerprint = None
+        if os.getenv("SEMANTIC_CACHE", "false").lower() == "true":
+            self.answer_cache = SemanticAnswerCache(
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.55")),
+                path=os.getenv("SEMANTIC_CACHE_PATH", "cache_respuestas.jsonl"),
+                log_path=os.getenv("SEMANTIC_CACHE_LOG", "cache_respuestas.log.jsonl")
+            )
         
     def create_file_search_store(self, store_name: str = "contratos-poc") -> str:
         """
@@ -40,13 +131,15 @@ class ContractAnalyzer:
         print(f"ℹ️ Modo Long Context activo. No se requiere Store: {store_name}")
         return "long-context-mode"
     
-    def upload_and_index_pdf(self, pdf_path: str, document_name: str = None) -> bool:
+    def upload_and_index_pdf(self, pdf_path: str, document_name: str = None,
+                             normalize: bool = False) -> bool:
         """
         Sube un PDF para análisis (Long Context)
         
         Args:
             pdf_path: Ruta al archivo PDF
             document_name: Nombre descriptivo para el documento
+            normalize: Subir el texto normalizado (sin cabeceras, pies ni ruido)
             
         Returns:
             True si se subió correctamente
@@ -58,23 +151,24 @@ class ContractAnalyzer:
         # Si no se proporciona nombre, usar el nombre del archivo
         if not document_name:
             document_name = Path(pdf_path).stem
+        self.document_path = pdf_path
+        self.normalized = None
             
         print(f"📤 Subiendo PDF: {pdf_path}")
         print(f"📝 Nombre del documento: {document_name}")
         
         try:
+            if normalize:
+                self.normalized = self.normalize_document(pdf_path)
+                if self.normalized:
+                    self.document_path = self.normalized.path
+            
             # Subir el archivo directamente
-            self.uploaded_file = self.client.files.upload(
-                file=pdf_path,
-                config={'display_name': document_name}
-            )
+            self.uploaded_file = self.upload_file(self.document_path, document_name)
             
             # Esperar a que se complete el procesamiento
             print("⏳ Procesando documento...")
-            while self.uploaded_file.state == "PROCESSING":
-                time.sleep(2)
-                self.uploaded_file = self.client.files.get(name=self.uploaded_file.name)
-                print(".", end="", flush=True)
+            self.uploaded_file = self.wait_until_processed(self.uploaded_file)
             
             if self.uploaded_file.state == "FAILED":
                 print("\n❌ Error: El procesamiento del archivo falló")
@@ -87,12 +181,118 @@ class ContractAnalyzer:
             print(f"❌ Error al subir el documento: {str(e)}")
             return False
     
-    def search_in_document(self, query: str) -> str:
+    def upload_file(self, path: str, document_name: str):
+        """
+        Sube un archivo sin esperar a que termine su procesamiento
+        
+        Args:
+            path: Ruta al archivo
+            document_name: Nombre descriptivo para el documento
+            
+        Los archivos grandes se suben por fragmentos de tamaño fijo, reanudando
+        desde el último byte confirmado si la subida se interrumpe.
+        
+        Returns:
+            Archivo subido (puede estar todavía en estado PROCESSING)
+        """
+        if self.resumable_uploader and os.path.getsize(path) >= self.resumable_threshold:
+            print(f"📦 Subida por fragmentos: {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+            resource = self.resumable_uploader.upload(path, document_name)
+            return self.client.files.get(name=resource["name"])
+        
+        return self.client.files.upload(
+            file=path,
+            config={'display_name': document_name}
+        )
+    
+    def wait_until_processed(self, uploaded_file, poll_interval: float = 2):
+        """
+        Espera a que un archivo subido salga del estado PROCESSING
+        
+        Args:
+            uploaded_file: Archivo devuelto por upload_file
+            poll_interval: Segundos entre consultas de estado
+            
+        Returns:
+            Archivo actualizado (estado ACTIVE o FAILED)
+        """
+        if getattr(self.client, "skip_waits", False):
+            poll_interval = 0
+        while uploaded_file.state == "PROCESSING":
+            time.sleep(poll_interval)
+            uploaded_file = self.client.files.get(name=uploaded_file.name)
+            print(".", end="", flush=True)
+        return uploaded_file
+    
+    def for_document(self, uploaded_file, document_path: str,
+                     normalized: Optional[NormalizedText] = None) -> "ContractAnalyzer":
+        """
+        Crea un analizador que comparte cliente y caché pero apunta a otro documento
+        
+        Permite analizar varios documentos a la vez sin pisar el estado de este.
+        
+        Args:
+            uploaded_file: Archivo ya subido y procesado
+            document_path: Ruta local del documento subido
+            normalized: Texto normalizado del documento, si se normalizó
+            
+        Returns:
+            Nuevo analizador para ese documento
+        """
+        analyzer = copy.copy(self)
+        analyzer.uploaded_file = uploaded_file
+        analyzer.document_path = document_path
+        analyzer.normalized = normalized
+        return analyzer
+    
+    def normalize_document(self, path: str) -> Optional[NormalizedText]:
+        """
+        Normaliza un documento antes de subirlo para reducir tokens
+        
+        Args:
+            path: Ruta al documento original
+            
+        Returns:
+            Texto normalizado (su .path es el archivo a subir), o None si no
+            tiene texto extraíble y hay que subir el original
+        """
+        normalized = normalize_file(path, os.getenv("NORMALIZED_DIR", ".normalizado"))
+        if normalized is None:
+            print(f"ℹ️ {path} no tiene texto extraíble (¿escaneado?); se sube el original")
+            return None
+        stats = normalized.stats()
+        print(f"🧹 Normalizado: {stats['tokens_originales']} → {stats['tokens_normalizados']} "
+              f"tokens (-{stats['ahorro_pct']}%)")
+        return normalized
+    
+    def cite_original(self, quote: str) -> Optional[str]:
+        """
+        Localiza en el documento original un fragmento citado en una respuesta
+        
+        Args:
+            quote: Fragmento literal del texto enviado al modelo
+            
+        Returns:
+            Texto original correspondiente, o None si no se encuentra
+        """
+        if self.normalized:
+            location = self.normalized.locate(quote)
+            return location[2] if location else None
+        if self.document_path and Path(self.document_path).suffix.lower() != ".pdf":
+            with open(self.document_path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            position = text.find(quote)
+            return text[position:position + len(quote)] if position >= 0 else None
+        return None
+    
+    def search_in_document(self, query: str, priority: Optional[str] = None) -> str:
         """
         Busca información específica en el documento usando Long Context
         
         Args:
             query: Pregunta o búsqueda a realizar
+            priority: Clase de prioridad ("interactive", "standard", "bulk");
+                      por defecto la del analizador
             
         Returns:
             Respuesta del modelo basada en el documento
@@ -102,20 +302,114 @@ class ContractAnalyzer:
         
         print(f"\n🔍 Analizando: {query}")
         
+        # Las respuestas se cachean por modelo y contenido del documento
+        if self.answer_cache:
+            cache_document = f"{self.model}:{self._document_fingerprint()}"
+            cached = self.answer_cache.lookup(cache_document, query)
+            if cached:
+                answer, score, original = cached
+                print(f"♻️ Respuesta en caché (similitud {score:.2f} con: {original.strip()[:80]})")
+                return answer
+        
         try:
             # Usar el archivo en el contexto
+            answer = self._generate([self.uploaded_file, query], priority)
+            if self.answer_cache:
+                self.answer_cache.store(cache_document, query, answer)
+            return answer
+            
+        except Exception as e:
+            if self.raise_errors:
+                raise
+            return f"❌ Error en el análisis: {str(e)}"
+    
+    def _document_fingerprint(self) -> str:
+        """
+        Huella del contenido del documento cargado, calculada una vez por versión
+        
+        Si el archivo local se edita o se sustituye, la huella cambia y las
+        respuestas guardadas para la versión anterior dejan de servirse.
+        """
+        if not self.document_path or not os.path.exists(self.document_path):
+            return self.uploaded_file.name
+        stat = os.stat(self.document_path)
+        identity = (self.document_path, stat.st_size, stat.st_mtime_ns)
+        if self._fingerprint is None or self._fingerprint[0] != identity:
+            self._fingerprint = (identity, file_fingerprint(self.document_path))
+        return self._fingerprint[1]
+    
+    def _generate(self, contents, priority: Optional[str] = None) -> str:
+        """
+        Envía una petición al modelo con la configuración del analizador
+        
+        La llamada espera turno en el planificador según su prioridad y el
+        inquilino/documento al que pertenece.
+        
+        Args:
+            contents: Contenido de la petición (archivo, texto o lista de ambos)
+            priority: Clase de prioridad; por defecto la del analizador
+            
+        Returns:
+            Texto de la respuesta del modelo
+        """
+        priority = priority or self.priority
+        # Con varias claves, la prioridad también ordena la espera de cuota
+        extra = {"priority": priority} if isinstance(self.client, PooledClient) else {}
+        
+        def call():
             response = self.client.models.generate_content(
                 model=self.model,
-                contents=[self.uploaded_file, query],
+                contents=contents,
                 config=types.GenerateContentConfig(
                     temperature=0.1,  # Baja temperatura para respuestas más precisas
                     candidate_count=1
-                )
+                ),
+                **extra
             )
-            
             return response.text
+        
+        tenant = self.tenant or self.document_path or "default"
+        return self.scheduler.run(call, priority, tenant)
+    
+    def _hierarchical_analysis(self, query: str, kind: str) -> str:
+        """
+        Analiza el documento por secciones (map-reduce) en lugar de en una sola llamada
+        
+        Args:
+            query: Consulta original, que define el formato de la respuesta final
+            kind: Tipo de análisis por sección ("resumen" o "riesgos")
             
+        Returns:
+            Resultado fusionado en el mismo formato que la consulta original
+        """
+        if not self.document_path:
+            return "❌ Error: No hay ningún documento cargado"
+        
+        try:
+            sections = load_sections(self.document_path)
+        except Exception as e:
+            if self.raise_errors:
+                raise
+            return f"❌ Error en el análisis: {str(e)}"
+        
+        # Sin texto local (PDF escaneado) o con una sola sección no compensa
+        # el map-reduce: basta una llamada sobre el archivo subido
+        if len(sections) <= 1:
+            if not sections:
+                print("ℹ️ Sin texto extraíble localmente; se analiza el archivo subido en una sola llamada")
+            return self.search_in_document(query)
+        
+        try:
+            return run_hierarchical(
+                sections, query, kind,
+                generate=self._generate,
+                cache=self.section_cache,
+                model=self.model,
+                max_workers=int(os.getenv("HIERARCHICAL_WORKERS", "4"))
+            )
         except Exception as e:
+            if self.raise_errors:
+                raise
             return f"❌ Error en el análisis: {str(e)}"
     
     def extract_contract_info(self) -> Dict:
@@ -153,48 +447,35 @@ class ContractAnalyzer:
         
         return contract_info
     
-    def generate_contract_summary(self) -> str:
+    def generate_contract_summary(self, hierarchical: bool = False) -> str:
         """
         Genera un resumen ejecutivo del contrato
         
+        Args:
+            hierarchical: Resumir por secciones en paralelo (contratos extensos)
+        
         Returns:
             Resumen en texto del contrato
         """
-        query = """
-        Genera un resumen ejecutivo profesional de este contrato que incluya:
-        1. Tipo y objeto del contrato
-        2. Partes involucradas
-        3. Términos económicos principales
-        4. Duración y condiciones temporales
-        5. Obligaciones principales de cada parte
-        6. Cláusulas críticas o puntos de atención
-        
-        El resumen debe ser conciso pero completo, en español, y con un tono profesional.
-        """
-        
         print("\n📄 Generando resumen ejecutivo...")
-        return self.search_in_document(query)
+        if hierarchical:
+            return self._hierarchical_analysis(SUMMARY_QUERY, "resumen")
+        return self.search_in_document(SUMMARY_QUERY)
     
-    def analyze_risks(self) -> str:
+    def analyze_risks(self, hierarchical: bool = False) -> str:
         """
         Analiza posibles riesgos o puntos de atención en el contrato
         
+        Args:
+            hierarchical: Analizar por secciones en paralelo (contratos extensos)
+        
         Returns:
             Análisis de riesgos
         """
-        query = """
-        Analiza este contrato e identifica:
-        1. Posibles riesgos legales o comerciales
-        2. Cláusulas que podrían ser desfavorables para alguna de las partes
-        3. Ambigüedades o puntos que necesitan aclaración
-        4. Penalizaciones o sanciones contempladas
-        5. Condiciones de terminación o rescisión
-        
-        Proporciona un análisis objetivo y profesional.
-        """
-        
         print("\n⚠️ Analizando riesgos...")
-        return self.search_in_document(query)
+        if hierarchical:
+            return self._hierarchical_analysis(RISK_QUERY, "riesgos")
+        return self.search_in_document(RISK_QUERY)
     
     def cleanup(self):
         """
@@ -209,6 +490,13 @@ class ContractAnalyzer:
             except Exception as e:
                 print(f"⚠️ No se pudieron limpiar los recursos: {str(e)}")
 
+    def close(self):
+        """
+        Cierra el cassette si se está grabando
+        """
+        if isinstance(self.client, RecordingClient):
+            self.client.close()
+
 
 def main():
     """
@@ -220,9 +508,11 @@ def main():
     print("="*60)
     
     # ⚠️ IMPORTANTE: Configura tu API key aquí
-    API_KEY = os.getenv("GOOGLE_AI_API_KEY")  # Obtener de variable de entorno
+    # Obtener de variable de entorno (GOOGLE_AI_API_KEYS admite varias separadas por comas)
+    API_KEY = os.getenv("GOOGLE_AI_API_KEYS") or os.getenv("GOOGLE_AI_API_KEY")
     
-    if not API_KEY:
+    # En modo replay las respuestas salen del cassette y no se necesita API key
+    if not API_KEY and os.getenv("CASSETTE_MODE", "").lower() != "replay":
         print("""
         ❌ ERROR: No se encontró la API Key
         
@@ -237,8 +527,15 @@ def main():
     # Ruta al archivo de prueba
     PDF_PATH = "contrato_ejemplo.txt"  # Cambiado para prueba sin PDF
     
+    # Modo jerárquico (map-reduce) para contratos que no caben en una llamada
+    HIERARCHICAL = os.getenv("HIERARCHICAL_MODE", "false").lower() == "true"
+    
+    # Normalizar el texto antes de subirlo (elimina cabeceras, pies y ruido)
+    NORMALIZE = os.getenv("NORMALIZE_TEXT", "false").lower() == "true"
+    
     # Crear el analizador
     analyzer = ContractAnalyzer(API_KEY)
+    start_time = time.time()
     
     try:
         # 1. Crear el almacén de búsqueda
@@ -246,7 +543,7 @@ def main():
         analyzer.create_file_search_store(store_name)
         
         # 2. Subir e indexar el PDF
-        if not analyzer.upload_and_index_pdf(PDF_PATH, "Contrato de Prueba"):
+        if not analyzer.upload_and_index_pdf(PDF_PATH, "Contrato de Prueba", normalize=NORMALIZE):
             print("❌ No se pudo procesar el PDF")
             return
         
@@ -266,14 +563,14 @@ def main():
         print("\n" + "="*60)
         print("RESUMEN EJECUTIVO")
         print("="*60)
-        summary = analyzer.generate_contract_summary()
+        summary = analyzer.generate_contract_summary(hierarchical=HIERARCHICAL)
         print(summary)
         
         # 5. Análisis de riesgos
         print("\n" + "="*60)
         print("ANÁLISIS DE RIESGOS")
         print("="*60)
-        risks = analyzer.analyze_risks()
+        risks = analyzer.analyze_risks(hierarchical=HIERARCHICAL)
         print(risks)
         
         # 6. Búsquedas personalizadas
@@ -300,6 +597,10 @@ def main():
         results = {
             "fecha_analisis": datetime.now().isoformat(),
             "archivo_procesado": PDF_PATH,
+            "modelo": analyzer.model,
+            "modo_jerarquico": HIERARCHICAL,
+            "duracion_segundos": round(time.time() - start_time, 2),
+            "normalizacion": analyzer.normalized.stats() if analyzer.normalized else None,
             "informacion_extraida": contract_info,
             "resumen": summary,
             "analisis_riesgos": risks
@@ -310,13 +611,28 @@ def main():
         
         print("✅ Resultados guardados en 'resultados_analisis.json'")
         
+        # Almacén indexado con campos tipados para consultas entre contratos
+        db_path = os.getenv("RESULTS_DB", "resultados.db")
+        store = ResultsStore(db_path)
+        store.save(results)
+        store.close()
+        print(f"✅ Resultados indexados en '{db_path}'")
+        
     except Exception as e:
         print(f"\n❌ Error general: {str(e)}")
     
     finally:
         # Opcional: Limpiar recursos (comentar si quieres mantener el store)
         # analyzer.cleanup()
-        pass
+        analyzer.close()
+    
+    # Con cassette, mostrar llamadas y tiempos para comparar ejecuciones
+    if hasattr(analyzer.client, "stats"):
+        print(f"\n📼 Cassette: {json.dumps(analyzer.client.stats.summary(), ensure_ascii=False)}")
+    
+    # Con varias claves, mostrar el reparto de peticiones entre ellas
+    if hasattr(analyzer.client, "pool"):
+        print(f"\n🔑 Claves: {json.dumps(analyzer.client.pool.metrics(), ensure_ascii=False)}")
     
     print("\n" + "="*60)
     print("POC COMPLETADO")
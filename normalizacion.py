@@ -0,0 +1,301 @@
+"""
+Normalización de texto previa a la subida para reducir tokens de contexto
+
+Elimina cabeceras y pies de página repetidos, numeración de páginas, huecos
+de firma y espacios sobrantes, y sustituye por una referencia los bloques de
+texto estándar (p. ej. anexos) que se repiten de forma idéntica dentro del
+mismo documento. Conserva un mapa de offsets para poder citar el texto original a partir de
+una posición o un fragmento del texto normalizado.
+"""
+
+import bisect
+import hashlib
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+# Líneas de los extremos de cada página candidatas a cabecera/pie
+EDGE_LINES = 3
+
+PAGE_NUMBER = re.compile(
+    r"^\s*(?:[-–—]\s*)?(?:p[áa]g(?:ina)?\.?\s*)?\d{1,4}(?:\s*(?:de|/|of)\s*\d{1,4})?(?:\s*[-–—])?\s*$",
+    re.IGNORECASE
+)
+# Número de página dentro de una cabecera o pie: "Página 3 de 40", "3/40" o un
+# número suelto separado del texto por un guion, una barra o varios espacios
+PAGE_REFERENCE = re.compile(
+    r"(?:p[áa]g(?:ina)?\.?|page)\s*\d{1,4}(?:\s*(?:de|/|of)\s*\d{1,4})?"
+    r"|\b\d{1,4}\s*(?:de|/|of)\s*\d{1,4}\b"
+    r"|^\s*\d{1,4}(?=\s*[|·•–—-]|\s{2,})"
+    r"|(?:[|·•–—-]|\s{2})\s*\d{1,4}\s*$",
+    re.IGNORECASE
+)
+SIGNATURE_PLACEHOLDER = re.compile(
+    r"^\s*(?:(?:\[\s*firma\s*\]|_{3,}|\.{5,}|fdo\.?:?)\s*)+$",
+    re.IGNORECASE
+)
+
+# Párrafos a partir de este tamaño se deduplican dentro del documento
+MIN_BOILERPLATE_CHARS = 400
+
+# Media mínima de caracteres por página para considerar que hay capa de texto
+MIN_CHARS_PER_PAGE = 20
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación aproximada de tokens (~4 caracteres por token)"""
+    return math.ceil(len(text) / 4)
+
+
+def _line_key(line: str) -> str:
+    """
+    Clave para comparar líneas entre páginas
+
+    Ignora los espacios y el número de página, pero no otros números, para que
+    líneas como "CLÁUSULA 3" y "CLÁUSULA 7" no cuenten como la misma cabecera.
+    """
+    if PAGE_NUMBER.match(line):
+        return "#"
+    line = PAGE_REFERENCE.sub(lambda m: re.sub(r"\d+", "#", m.group()), line)
+    return " ".join(line.lower().split())
+
+
+def has_text_layer(text: str) -> bool:
+    """Indica si el texto extraído tiene contenido (un PDF escaneado no lo tiene)"""
+    pages = text.split("\f")
+    return len("".join(text.split())) >= MIN_CHARS_PER_PAGE * len(pages)
+
+
+class NormalizedText:
+    """
+    Texto normalizado con su mapa de offsets al texto original
+
+    Cada segmento (inicio_normalizado, inicio_original, longitud) indica un
+    tramo copiado literalmente del original.
+    """
+
+    def __init__(self, original: str, text: str, segments: List[Tuple[int, int, int]],
+                 removed: Dict[str, int]):
+        self.original = original
+        self.text = text
+        self.segments = segments
+        self.removed = removed
+        self.path: Optional[str] = None
+        self._starts = [s[0] for s in segments]
+
+    def to_original(self, position: int) -> int:
+        """Convierte una posición del texto normalizado en una del original"""
+        i = bisect.bisect_right(self._starts, position) - 1
+        if i < 0:
+            return 0
+        norm_start, orig_start, length = self.segments[i]
+        return orig_start + min(position - norm_start, length)
+
+    def original_span(self, start: int, end: int) -> Tuple[int, int]:
+        """Convierte un rango [start, end) del texto normalizado en un rango del original"""
+        return self.to_original(start), self.to_original(max(start, end - 1)) + 1
+
+    def locate(self, quote: str) -> Optional[Tuple[int, int, str]]:
+        """
+        Busca una cita (p. ej. extraída de una respuesta) y la devuelve en el original
+
+        Returns:
+            Tupla (inicio, fin, texto_original) o None si no se encuentra
+        """
+        quote = " ".join(quote.split())
+        if not quote:
+            return None
+        position = self.text.find(quote)
+        if position < 0:
+            position = self.text.lower().find(quote.lower())
+        if position < 0:
+            return None
+        start, end = self.original_span(position, position + len(quote))
+        return start, end, self.original[start:end]
+
+    def stats(self) -> Dict:
+        """Resumen del ahorro conseguido"""
+        before = estimate_tokens(self.original)
+        after = estimate_tokens(self.text)
+        return {
+            "tokens_originales": before,
+            "tokens_normalizados": after,
+            "tokens_ahorrados": before - after,
+            "ahorro_pct": round(100 * (before - after) / before, 1) if before else 0.0,
+            "lineas_eliminadas": dict(self.removed)
+        }
+
+
+def normalize_text(text: str) -> NormalizedText:
+    """
+    Normaliza el texto de un contrato
+
+    Las páginas se separan por saltos de página (\\f), como los que produce la
+    extracción de texto de un PDF.
+
+    Args:
+        text: Texto original
+
+    Returns:
+        Texto normalizado con su mapa de offsets
+    """
+    # Líneas con su posición en el original, agrupadas por página
+    pages: List[List[Tuple[int, str]]] = []
+    offset = 0
+    for page in text.split("\f"):
+        lines = []
+        for line in page.splitlines(keepends=True):
+            lines.append((offset, line.rstrip("\r\n")))
+            offset += len(line)
+        pages.append(lines)
+        offset += 1  # El propio \f
+
+    # Cabeceras y pies: líneas de los extremos que se repiten en muchas páginas
+    threshold = max(2, math.ceil(len(pages) / 2))
+    repeated = set()
+    if len(pages) >= 2:
+        counts = Counter()
+        for lines in pages:
+            content = [line for _, line in lines if line.strip()]
+            edges = content[:EDGE_LINES] + content[-EDGE_LINES:]
+            counts.update({_line_key(line) for line in edges})
+        # Los números de página sueltos se tratan aparte
+        repeated = {key for key, n in counts.items() if n >= threshold and key != "#"}
+
+    # Números de página: en cada borde, el primer número suelto con solo
+    # cabeceras o pies entre él y el borde. Se eliminan únicamente en el borde
+    # (superior o inferior) donde aparecen en la mayoría de páginas; un número
+    # suelto en otra posición puede ser una celda de una tabla.
+    candidates = []
+    for lines in pages:
+        content_idx = [i for i, (_, line) in enumerate(lines) if line.strip()]
+        found = []
+        for run in (content_idx[:EDGE_LINES], content_idx[::-1][:EDGE_LINES]):
+            index = None
+            for i in run:
+                if PAGE_NUMBER.match(lines[i][1]):
+                    index = i
+                    break
+                if _line_key(lines[i][1]) not in repeated:
+                    break
+            found.append(index)
+        candidates.append(found)
+    numbered_edges = [
+        sum(1 for found in candidates if found[edge] is not None) >= threshold
+        for edge in (0, 1)
+    ]
+
+    removed = Counter()
+    paragraphs: List[List[Tuple[int, str]]] = [[]]
+    for lines, found in zip(pages, candidates):
+        content_idx = [i for i, (_, line) in enumerate(lines) if line.strip()]
+        edge_idx = set(content_idx[:EDGE_LINES] + content_idx[-EDGE_LINES:])
+        page_number_idx = {
+            i for i, numbered in zip(found, numbered_edges) if numbered and i is not None
+        }
+        for i, (start, line) in enumerate(lines):
+            if not line.strip():
+                if paragraphs[-1]:
+                    paragraphs.append([])
+                continue
+            if i in edge_idx and _line_key(line) in repeated:
+                removed["cabeceras_pies"] += 1
+            elif i in page_number_idx:
+                removed["numeracion"] += 1
+            elif SIGNATURE_PLACEHOLDER.match(line):
+                removed["huecos_firma"] += 1
+            else:
+                paragraphs[-1].append((start, line))
+
+    # Emitir el texto colapsando espacios y registrando los segmentos copiados
+    out: List[str] = []
+    segments: List[List[int]] = []
+    length = 0
+
+    def emit(piece: str, orig_start: Optional[int]):
+        nonlocal length
+        if orig_start is not None:
+            last = segments[-1] if segments else None
+            if (last and last[0] + last[2] + 1 == length and last[1] + last[2] + 1 == orig_start
+                    and text[orig_start - 1] == out[-1]):
+                last[2] += 1 + len(piece)  # Tramo contiguo: ampliar el segmento anterior
+            else:
+                segments.append([length, orig_start, len(piece)])
+        out.append(piece)
+        length += len(piece)
+
+    # Bloques largos ya emitidos en este documento (el modelo ve la primera copia)
+    seen_blocks = set()
+    for paragraph in paragraphs:
+        if not paragraph:
+            continue
+        if length:
+            emit("\n", None)
+        joined = " ".join(" ".join(line.split()) for _, line in paragraph)
+        if len(joined) >= MIN_BOILERPLATE_CHARS:
+            digest = hashlib.sha1(joined.encode("utf-8")).hexdigest()[:12]
+            if digest in seen_blocks:
+                ref = f"[Texto estándar {digest} omitido; idéntico a un bloque anterior del documento]"
+                removed["texto_estandar"] += len(paragraph)
+                emit(ref, None)
+                segments.append([length - len(ref), paragraph[0][0], 0])
+                emit("\n", None)
+                continue
+            seen_blocks.add(digest)
+        for start, line in paragraph:
+            first = True
+            for match in re.finditer(r"\S+", line):
+                if not first:
+                    emit(" ", None)
+                emit(match.group(), start + match.start())
+                first = False
+            emit("\n", None)
+
+    segments.sort(key=lambda s: s[0])
+    return NormalizedText(text, "".join(out), [tuple(s) for s in segments], dict(removed))
+
+
+def read_document_text(path: str) -> str:
+    """
+    Lee el texto de un documento local (PDF mediante PyPDF2, con \\f entre páginas)
+    """
+    if Path(path).suffix.lower() == ".pdf":
+        try:
+            from PyPDF2 import PdfReader
+        except ImportError:
+            raise RuntimeError("La normalización de PDF requiere PyPDF2: pip install PyPDF2")
+        return "\f".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def normalize_file(path: str, output_dir: str = ".normalizado") -> Optional[NormalizedText]:
+    """
+    Normaliza un documento y guarda el texto resultante y su mapa de offsets
+
+    Args:
+        path: Ruta al documento original
+        output_dir: Carpeta donde se escriben el .txt normalizado y el .map.json
+
+    Returns:
+        Texto normalizado (con .path apuntando al archivo a subir), o None si
+        no se pudo extraer texto (PDF escaneado) y hay que subir el original
+    """
+    text = read_document_text(path)
+    if not has_text_layer(text):
+        return None
+    normalized = normalize_text(text)
+    directory = Path(output_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha1(str(Path(path).resolve()).encode("utf-8")).hexdigest()[:8]
+    target = directory / f"{Path(path).stem}-{digest}.txt"
+    target.write_text(normalized.text, encoding="utf-8")
+    with open(target.with_suffix(".map.json"), "w", encoding="utf-8") as f:
+        json.dump({"original": path, "segmentos": normalized.segments,
+                   "estadisticas": normalized.stats()}, f, ensure_ascii=False)
+    normalized.path = str(target)
+    return normalized
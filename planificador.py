@@ -0,0 +1,143 @@
+"""
+Planificador de llamadas al modelo con clases de prioridad
+
+Las consultas interactivas, las estándar y los trabajos masivos comparten la
+misma cuota. El planificador limita la concurrencia total y la de cada clase,
+atiende siempre primero la clase de mayor prioridad y, dentro de cada clase,
+reparte los turnos por rondas entre inquilinos/documentos para que uno solo
+no acapare la cola. Las clases bajas solo usan la capacidad que sobra.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+
+# Clases de prioridad, de mayor a menor
+PRIORITIES = ("interactive", "standard", "bulk")
+
+
+class _Ticket:
+    __slots__ = ("enqueued", "granted")
+
+    def __init__(self):
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class PriorityScheduler:
+    """
+    Controla qué llamada al modelo se ejecuta en cada momento
+    """
+
+    def __init__(self, max_concurrency: int = 8, class_limits: Optional[Dict[str, int]] = None,
+                 wait_samples: int = 1000):
+        """
+        Args:
+            max_concurrency: Llamadas simultáneas en total
+            class_limits: Máximo de llamadas simultáneas por clase. Por defecto
+                las clases bajas dejan huecos libres para las interactivas.
+            wait_samples: Número de tiempos de espera recientes que se conservan
+        """
+        self.max_concurrency = max_concurrency
+        self.class_limits = {
+            "interactive": max_concurrency,
+            "standard": max(1, max_concurrency - 1),
+            "bulk": max(1, max_concurrency * 3 // 4)
+        }
+        self.class_limits.update(class_limits or {})
+        self._cond = threading.Condition()
+        self._queues = {p: OrderedDict() for p in PRIORITIES}
+        self._running = {p: 0 for p in PRIORITIES}
+        self._served = {p: 0 for p in PRIORITIES}
+        self._waits = {p: deque(maxlen=wait_samples) for p in PRIORITIES}
+
+    def run(self, func: Callable, priority: str = "standard", tenant: str = "default"):
+        """
+        Ejecuta func cuando el planificador le asigna un hueco
+
+        Args:
+            func: Función sin argumentos que hace la llamada al modelo
+            priority: Clase de prioridad ("interactive", "standard" o "bulk")
+            tenant: Inquilino o documento, para el reparto justo dentro de la clase
+
+        Returns:
+            Lo que devuelva func
+        """
+        with self.slot(priority, tenant):
+            return func()
+
+    @contextmanager
+    def slot(self, priority: str = "standard", tenant: str = "default"):
+        """Reserva un hueco de ejecución mientras dura el bloque with"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Prioridad desconocida: {priority} (usa {', '.join(PRIORITIES)})")
+        ticket = _Ticket()
+        with self._cond:
+            self._queues[priority].setdefault(tenant, deque()).append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                self._cond.wait()
+            self._waits[priority].append(time.monotonic() - ticket.enqueued)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running[priority] -= 1
+                self._dispatch()
+
+    def _dispatch(self):
+        """Concede huecos libres por orden de prioridad (se llama con el lock tomado)"""
+        granted = False
+        while sum(self._running.values()) < self.max_concurrency:
+            for priority in PRIORITIES:
+                tenants = self._queues[priority]
+                if tenants and self._running[priority] < self.class_limits[priority]:
+                    # Turno por rondas: el primer inquilino pasa al final de la fila
+                    tenant, pending = next(iter(tenants.items()))
+                    ticket = pending.popleft()
+                    if pending:
+                        tenants.move_to_end(tenant)
+                    else:
+                        del tenants[tenant]
+                    ticket.granted = True
+                    self._running[priority] += 1
+                    self._served[priority] += 1
+                    granted = True
+                    break
+            else:
+                break
+        if granted:
+            self._cond.notify_all()
+
+    def metrics(self) -> Dict[str, Dict]:
+        """
+        Métricas por clase: profundidad de cola, llamadas en curso y tiempos de espera
+
+        Returns:
+            Diccionario {clase: {en_cola, en_curso, atendidas, espera_p50, espera_p95, espera_max}}
+        """
+        with self._cond:
+            result = {}
+            for priority in PRIORITIES:
+                waits = sorted(self._waits[priority])
+                result[priority] = {
+                    "en_cola": sum(len(q) for q in self._queues[priority].values()),
+                    "en_curso": self._running[priority],
+                    "atendidas": self._served[priority],
+                    "espera_p50": round(_percentile(waits, 50), 3),
+                    "espera_p95": round(_percentile(waits, 95), 3),
+                    "espera_max": round(waits[-1], 3) if waits else 0.0
+                }
+            return result
+
+
+def _percentile(values: list, pct: float) -> float:
+    """Percentil por el método del rango más cercano (valores ya ordenados)"""
+    if not values:
+        return 0.0
+    index = max(0, math.ceil(pct / 100 * len(values)) - 1)
+    return values[index]
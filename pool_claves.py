@@ -0,0 +1,372 @@
+"""
+Pool de API keys (o proyectos) para repartir la carga entre varias cuotas
+
+Expone la misma interfaz que genai.Client (files.upload, files.get,
+models.generate_content), pero reparte las llamadas entre varias claves:
+
+- Lleva la cuenta de peticiones y tokens del último minuto de cada clave
+- Cada archivo subido queda fijado a la clave que lo subió, porque los
+  archivos solo son visibles para esa clave; todas las llamadas que lo usan
+  van por ella
+- Un archivo no fijado (p. ej. subido en otra ejecución) se busca probando
+  las claves; un 403/404 sobre ese archivo no retira la clave
+- Las subidas reanudables continúan por la clave que guardó su progreso
+- Las subidas y las llamadas sin archivo van a la clave con más margen
+- Sin cuota, las llamadas al modelo esperan por orden de prioridad
+  (models.generate_content acepta priority, como el planificador)
+- Las claves que fallan se retiran temporalmente y vuelven solas a la
+  rotación cuando termina su periodo de enfriamiento; una clave no válida
+  (401/403, o 400 API_KEY_INVALID) se retira durante más tiempo
+"""
+
+import hashlib
+import itertools
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from google import genai
+
+from planificador import PRIORITIES
+from subida_reanudable import ResumableUploader
+
+
+# Periodo de enfriamiento (segundos) según el tipo de error
+COOLDOWN_AUTH = 600
+COOLDOWN_RATE_LIMIT = 60
+COOLDOWN_ERRORS = 30
+
+# Fallos seguidos (no de cuota ni de autenticación) antes de retirar una clave
+MAX_CONSECUTIVE_ERRORS = 3
+
+# Códigos con los que la API rechaza un archivo de otro proyecto: en una
+# petición sobre un archivo no indican un problema de la clave
+FILE_ACCESS_CODES = (403, 404)
+
+# Motivo con el que la API responde 400 (y no 401/403) a una clave no válida
+INVALID_KEY_REASON = "API_KEY_INVALID"
+
+
+def _error_code(error: Exception) -> Optional[int]:
+    return getattr(error, "code", None) or getattr(error, "status_code", None)
+
+
+def _is_auth_error(error: Exception, code: Optional[int]) -> bool:
+    """401/403, o 400 con motivo API_KEY_INVALID: la clave no sirve"""
+    if code in (401, 403):
+        return True
+    details = f"{error} {getattr(error, 'details', '')} {getattr(error, 'message', '')}"
+    return code == 400 and INVALID_KEY_REASON in details
+
+
+class KeySlot:
+    """
+    Una clave del pool con su contabilidad de cuota y su estado de salud
+    """
+
+    def __init__(self, api_key: str, client, rpm_limit: int, tpm_limit: int = 0):
+        self.api_key = api_key
+        self.label = f"…{api_key[-4:]}"
+        self.client = client
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.requests = deque()  # Marcas de tiempo del último minuto
+        self.tokens = deque()    # (marca de tiempo, tokens) del último minuto
+        self.cooldown_until = 0.0
+        self.consecutive_errors = 0
+        self.total_requests = 0
+        self.total_errors = 0
+        self.pinned_files = 0
+
+    def _trim(self, now: float):
+        while self.requests and now - self.requests[0] >= 60:
+            self.requests.popleft()
+        while self.tokens and now - self.tokens[0][0] >= 60:
+            self.tokens.popleft()
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def headroom(self, now: float) -> float:
+        """Fracción de la cuota por minuto todavía disponible (0-1)"""
+        self._trim(now)
+        free = 1 - len(self.requests) / self.rpm_limit
+        if self.tpm_limit:
+            used_tokens = sum(n for _, n in self.tokens)
+            free = min(free, 1 - used_tokens / self.tpm_limit)
+        return max(0.0, free)
+
+    def next_free(self, now: float) -> float:
+        """Segundos hasta que vuelva a haber cuota"""
+        self._trim(now)
+        waits = [0.0]
+        if len(self.requests) >= self.rpm_limit:
+            waits.append(60 - (now - self.requests[0]))
+        if self.tpm_limit and self.tokens and sum(n for _, n in self.tokens) >= self.tpm_limit:
+            waits.append(60 - (now - self.tokens[0][0]))
+        return max(waits)
+
+    def metrics(self, now: float) -> Dict:
+        return {
+            "clave": self.label,
+            "sana": self.healthy(now),
+            "margen": round(self.headroom(now), 3),
+            "peticiones_ultimo_minuto": len(self.requests),
+            "peticiones_totales": self.total_requests,
+            "errores_totales": self.total_errors,
+            "archivos_fijados": self.pinned_files
+        }
+
+
+class KeyPool:
+    """
+    Reparte peticiones entre varias claves según su margen de cuota
+    """
+
+    def __init__(self, api_keys: List[str], rpm_limit: int = 60, tpm_limit: int = 0,
+                 client_factory: Optional[Callable] = None):
+        """
+        Args:
+            api_keys: API keys (una por proyecto) entre las que repartir la carga
+            rpm_limit: Peticiones por minuto permitidas en cada clave
+            tpm_limit: Tokens por minuto permitidos en cada clave (0 = sin límite)
+            client_factory: Función que crea un cliente a partir de una clave
+        """
+        if not api_keys:
+            raise ValueError("El pool necesita al menos una API key")
+        factory = client_factory or (lambda key: genai.Client(api_key=key))
+        self.slots = [KeySlot(key, factory(key), rpm_limit, tpm_limit) for key in api_keys]
+        self._pins: Dict[str, KeySlot] = {}
+        self._cond = threading.Condition()
+        # Peticiones en curso de acquire: (rango de prioridad, orden de llegada, claves válidas)
+        self._waiters: List[tuple] = []
+        self._arrivals = itertools.count()
+
+    def pin(self, file_name: str, slot: KeySlot):
+        """Fija un archivo subido a la clave que lo subió"""
+        with self._cond:
+            if file_name not in self._pins:
+                slot.pinned_files += 1
+            self._pins[file_name] = slot
+
+    def pinned(self, file_name: str) -> Optional[KeySlot]:
+        with self._cond:
+            return self._pins.get(file_name)
+
+    def acquire(self, slot: Optional[KeySlot] = None, exclude: Iterable[KeySlot] = (),
+                priority: str = "standard") -> KeySlot:
+        """
+        Reserva una petición en una clave, esperando si no queda cuota
+
+        Cuando se agota la cuota, las peticiones que esperan se atienden por
+        orden de prioridad y, dentro de cada clase, por orden de llegada: una
+        petición no ocupa una clave que también sirve a otra anterior en ese
+        orden.
+
+        Args:
+            slot: Clave obligatoria (documentos fijados); si es None se elige
+                  la clave sana con más margen
+            exclude: Claves ya probadas para esta petición
+            priority: Clase de prioridad ("interactive", "standard" o "bulk")
+
+        Returns:
+            Clave en la que se ha contabilizado la petición
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Prioridad desconocida: {priority} (usa {', '.join(PRIORITIES)})")
+        excluded = {id(s) for s in exclude}
+        with self._cond:
+            if slot is not None:
+                usable = {id(slot)}
+            else:
+                usable = {id(s) for s in self.slots if id(s) not in excluded} or {id(s) for s in self.slots}
+            waiter = (PRIORITIES.index(priority), next(self._arrivals), usable)
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    now = time.time()
+                    if slot is not None:
+                        chosen = slot if slot.headroom(now) > 0 else None
+                        wait = max(slot.next_free(now), slot.cooldown_until - now)
+                    else:
+                        allowed = [s for s in self.slots if id(s) in usable]
+                        candidates = [s for s in allowed if s.healthy(now)]
+                        if not candidates:
+                            # Todas retiradas: esperar a la primera que vuelva
+                            chosen = None
+                            wait = min(s.cooldown_until for s in allowed) - now
+                        else:
+                            chosen = max(candidates, key=lambda s: (s.headroom(now), -s.pinned_files))
+                            if chosen.headroom(now) <= 0:
+                                chosen = None
+                            wait = min(s.next_free(now) for s in candidates)
+                    if chosen is not None and (slot is None or chosen.healthy(now)):
+                        ahead = any(other[:2] < waiter[:2] and id(chosen) in other[2]
+                                    for other in self._waiters)
+                        if not ahead:
+                            chosen.requests.append(now)
+                            chosen.total_requests += 1
+                            return chosen
+                    self._cond.wait(timeout=max(0.05, wait))
+            finally:
+                self._waiters.remove(waiter)
+                self._cond.notify_all()
+
+    def report_success(self, slot: KeySlot, tokens: int = 0):
+        with self._cond:
+            slot.consecutive_errors = 0
+            if tokens:
+                slot.tokens.append((time.time(), tokens))
+
+    def report_error(self, slot: KeySlot, error: Exception, file_request: bool = False) -> bool:
+        """
+        Retira temporalmente la clave si el error lo justifica
+
+        Args:
+            slot: Clave que recibió el error
+            error: Excepción de la llamada
+            file_request: La petición usaba un archivo no fijado a esta clave;
+                          un 403/404 solo indica que el archivo es de otra clave
+
+        Returns:
+            True si el error marca la clave como no válida y se ha retirado
+        """
+        code = _error_code(error)
+        with self._cond:
+            slot.total_errors += 1
+            if file_request and code in FILE_ACCESS_CODES:
+                return False
+            slot.consecutive_errors += 1
+            now = time.time()
+            if _is_auth_error(error, code):
+                slot.cooldown_until = now + COOLDOWN_AUTH
+            elif code == 429:
+                slot.cooldown_until = now + COOLDOWN_RATE_LIMIT
+            elif slot.consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                slot.cooldown_until = now + COOLDOWN_ERRORS
+            else:
+                return False
+            print(f"⚠️ Clave {slot.label} retirada {int(slot.cooldown_until - now)}s "
+                  f"({code or type(error).__name__})")
+            self._cond.notify_all()
+            return True
+
+    def call(self, func: Callable, slot: Optional[KeySlot] = None, file_request: bool = False,
+             priority: str = "standard"):
+        """
+        Ejecuta func(slot) contabilizando la petición y la salud de la clave
+
+        Las llamadas no fijadas a una clave se reintentan en otra si el
+        error retira la clave elegida (autenticación, cuota o fallos seguidos)
+        o, en peticiones sobre un archivo (file_request), si la clave no tiene
+        acceso a ese archivo.
+        """
+        attempts = 1 if slot is not None else len(self.slots)
+        tried = []
+        for attempt in range(1, attempts + 1):
+            chosen = self.acquire(slot, exclude=tried, priority=priority)
+            tried.append(chosen)
+            try:
+                result = func(chosen)
+            except Exception as e:
+                key_bad = self.report_error(chosen, e, file_request and slot is None)
+                not_this_key = file_request and _error_code(e) in FILE_ACCESS_CODES
+                if attempt == attempts or not (key_bad or not_this_key):
+                    raise
+                continue
+            usage = getattr(result, "usage_metadata", None)
+            self.report_success(chosen, getattr(usage, "total_token_count", 0) or 0)
+            return result
+
+    def metrics(self) -> List[Dict]:
+        with self._cond:
+            now = time.time()
+            return [slot.metrics(now) for slot in self.slots]
+
+
+class PooledClient:
+    """
+    Cliente con la interfaz de genai.Client que enruta cada llamada por el pool
+    """
+
+    def __init__(self, pool: KeyPool, chunk_size: int = 8 * 1024 * 1024,
+                 state_dir: str = ".subidas"):
+        self.pool = pool
+        self.files = _PooledFiles(pool)
+        self.models = _PooledModels(pool)
+        self.resumable_uploader = _PooledResumableUploader(pool, chunk_size, state_dir)
+
+
+class _PooledFiles:
+    def __init__(self, pool: KeyPool):
+        self._pool = pool
+
+    def upload(self, file, config=None, **kwargs):
+        def do(slot):
+            uploaded = slot.client.files.upload(file=file, config=config, **kwargs)
+            self._pool.pin(uploaded.name, slot)
+            return uploaded
+        return self._pool.call(do)
+
+    def get(self, name: str, **kwargs):
+        slot = self._pool.pinned(name)
+
+        def do(s):
+            result = s.client.files.get(name=name, **kwargs)
+            self._pool.pin(name, s)  # Archivo de otra ejecución: queda fijado a la clave que lo ve
+            return result
+        return self._pool.call(do, slot, file_request=True)
+
+
+class _PooledModels:
+    def __init__(self, pool: KeyPool):
+        self._pool = pool
+
+    def generate_content(self, model: str, contents, config=None, priority: str = "standard",
+                         **kwargs):
+        # Si la petición incluye un archivo subido, debe ir por la clave que lo subió
+        items = contents if isinstance(contents, (list, tuple)) else [contents]
+        names = [getattr(item, "name", None) for item in items if getattr(item, "name", None)]
+        slot = next((self._pool.pinned(n) for n in names if self._pool.pinned(n)), None)
+
+        def do(s):
+            result = s.client.models.generate_content(model=model, contents=contents,
+                                                      config=config, **kwargs)
+            for name in names:
+                self._pool.pin(name, s)
+            return result
+        return self._pool.call(do, slot, file_request=bool(names), priority=priority)
+
+
+class _PooledResumableUploader:
+    """
+    Subida reanudable fijando el archivo a la clave que lo sube
+
+    Una subida interrumpida continúa por la clave que guardó su progreso; las
+    nuevas van a la clave con más margen.
+    """
+
+    def __init__(self, pool: KeyPool, chunk_size: int, state_dir: str):
+        self._pool = pool
+        # Una carpeta de estado por clave: una sesión de subida solo vale para su clave
+        self._uploaders = {
+            id(slot): ResumableUploader(
+                slot.api_key, chunk_size=chunk_size,
+                state_dir=str(Path(state_dir) / hashlib.sha1(slot.api_key.encode("utf-8")).hexdigest()[:12])
+            )
+            for slot in pool.slots
+        }
+
+    def upload(self, path: str, display_name: Optional[str] = None,
+               mime_type: Optional[str] = None) -> Dict:
+        def do(slot):
+            resource = self._uploaders[id(slot)].upload(path, display_name, mime_type)
+            self._pool.pin(resource["name"], slot)
+            return resource
+
+        # La sesión de subida solo vale para la clave que la abrió
+        pending = next((slot for slot in self._pool.slots
+                        if self._uploaders[id(slot)].has_pending(path)), None)
+        return self._pool.call(do, pending)
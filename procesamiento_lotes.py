@@ -0,0 +1,243 @@
+"""
+Pipeline por etapas para analizar lotes de contratos
+
+Separa el flujo en cuatro etapas conectadas por colas acotadas:
+
+    subida → espera de procesamiento → análisis → escritura de resultados
+
+Cada etapa tiene su propio número de hilos, de modo que el documento N+1 se
+sube y se procesa mientras el documento N se está consultando. Las colas
+acotadas aplican contrapresión: si una etapa se atrasa, las anteriores se
+bloquean en lugar de acumular documentos en memoria.
+"""
+
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from almacen_resultados import ResultsStore
+from main import ContractAnalyzer
+
+
+# Marca de fin de la entrada de una etapa
+_END = object()
+
+
+class BatchPipeline:
+    """
+    Pipeline concurrente de subida, espera, análisis y escritura de contratos
+    """
+
+    def __init__(self, analyzer: ContractAnalyzer, sink: Callable[[Dict], None],
+                 upload_workers: int = 2, wait_workers: int = 4,
+                 analysis_workers: int = 4, queue_size: int = 4,
+                 hierarchical: bool = False, normalize: bool = False,
+                 priority: str = "bulk"):
+        """
+        Configura el pipeline
+
+        Args:
+            analyzer: Analizador cuyo cliente se comparte entre etapas
+            sink: Función que recibe el resultado de cada documento (etapa de escritura)
+            upload_workers: Hilos de la etapa de subida
+            wait_workers: Hilos que esperan a que los archivos estén ACTIVE
+            analysis_workers: Hilos que ejecutan las consultas al modelo
+            queue_size: Capacidad de cada cola entre etapas
+            hierarchical: Usar el modo jerárquico para resumen y riesgos
+            normalize: Normalizar el texto de cada documento antes de subirlo
+            priority: Clase de prioridad de las llamadas al modelo del lote
+        """
+        self.analyzer = analyzer
+        self.sink = sink
+        self.upload_workers = upload_workers
+        self.wait_workers = wait_workers
+        self.analysis_workers = analysis_workers
+        self.queue_size = queue_size
+        self.hierarchical = hierarchical
+        self.normalize = normalize
+        self.priority = priority
+        self.stats = {"documentos": 0, "correctos": 0, "fallidos": 0}
+        self._stats_lock = threading.Lock()
+
+    def _upload(self, job: Dict) -> Dict:
+        job["inicio"] = time.time()
+        job["normalizado"] = self.analyzer.normalize_document(job["ruta"]) if self.normalize else None
+        upload_path = job["normalizado"].path if job["normalizado"] else job["ruta"]
+        job["archivo"] = self.analyzer.upload_file(upload_path, Path(job["ruta"]).stem)
+        return job
+
+    def _wait(self, job: Dict) -> Dict:
+        job["archivo"] = self.analyzer.wait_until_processed(job["archivo"])
+        if job["archivo"].state == "FAILED":
+            raise RuntimeError("El procesamiento del archivo falló")
+        return job
+
+    def _analyze(self, job: Dict) -> Dict:
+        normalized = job["normalizado"]
+        analyzer = self.analyzer.for_document(
+            job["archivo"], normalized.path if normalized else job["ruta"], normalized
+        )
+        analyzer.priority = self.priority
+        # Un fallo debe llegar a la etapa de escritura como error, no como
+        # respuesta, para no sobrescribir resultados anteriores correctos
+        analyzer.raise_errors = True
+        contract_info = analyzer.extract_contract_info()
+        summary = analyzer.generate_contract_summary(hierarchical=self.hierarchical)
+        risks = analyzer.analyze_risks(hierarchical=self.hierarchical)
+        return {
+            "fecha_analisis": datetime.now().isoformat(),
+            "archivo_procesado": job["ruta"],
+            "modelo": analyzer.model,
+            "modo_jerarquico": self.hierarchical,
+            "duracion_segundos": round(time.time() - job["inicio"], 2),
+            "normalizacion": normalized.stats() if normalized else None,
+            "informacion_extraida": contract_info,
+            "resumen": summary,
+            "analisis_riesgos": risks
+        }
+
+    def _write(self, item):
+        # Los errores de etapas anteriores llegan aquí para quedar registrados
+        with self._stats_lock:
+            self.stats["documentos"] += 1
+        if isinstance(item, dict) and "error" in item:
+            print(f"❌ {item['ruta']}: {item['error']}")
+            with self._stats_lock:
+                self.stats["fallidos"] += 1
+            return
+        self.sink(item)
+        print(f"✅ {item['archivo_procesado']} ({item['duracion_segundos']}s)")
+        with self._stats_lock:
+            self.stats["correctos"] += 1
+
+    def _stage(self, name: str, func: Callable, inbox: queue.Queue,
+               outbox: Optional[queue.Queue], workers: int) -> list:
+        """
+        Lanza los hilos de una etapa
+
+        El último hilo en terminar propaga la marca de fin a la siguiente etapa.
+        """
+        remaining = [workers]
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                job = inbox.get()
+                if job is _END:
+                    inbox.put(_END)  # Para que los demás hilos de la etapa también terminen
+                    break
+                if "error" in job or outbox is None:
+                    result = job
+                else:
+                    try:
+                        result = func(job)
+                    except Exception as e:
+                        result = {"ruta": job["ruta"], "error": f"{name}: {str(e)}"}
+                if outbox is not None:
+                    outbox.put(result)
+                else:
+                    try:
+                        func(result)
+                    except Exception as e:
+                        print(f"❌ Error al guardar resultados: {str(e)}")
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0 and outbox is not None:
+                    outbox.put(_END)
+
+        threads = [threading.Thread(target=worker, name=f"{name}-{i}", daemon=True)
+                   for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run(self, paths: Iterable[str]) -> Dict:
+        """
+        Procesa un lote de documentos
+
+        Args:
+            paths: Rutas de los documentos (se consumen de forma perezosa)
+
+        Returns:
+            Estadísticas del lote (documentos, correctos, fallidos, segundos)
+        """
+        start = time.time()
+        to_upload = queue.Queue(self.queue_size)
+        to_wait = queue.Queue(self.queue_size)
+        to_analyze = queue.Queue(self.queue_size)
+        to_write = queue.Queue(self.queue_size)
+
+        threads = []
+        threads += self._stage("subida", self._upload, to_upload, to_wait, self.upload_workers)
+        threads += self._stage("espera", self._wait, to_wait, to_analyze, self.wait_workers)
+        threads += self._stage("analisis", self._analyze, to_analyze, to_write, self.analysis_workers)
+        threads += self._stage("escritura", self._write, to_write, None, 1)
+
+        # put() bloquea cuando la cola está llena: contrapresión hasta la entrada
+        for path in paths:
+            if not os.path.exists(path):
+                to_write.put({"ruta": path, "error": "No se encuentra el archivo"})
+                continue
+            to_upload.put({"ruta": path})
+        to_upload.put(_END)
+
+        for thread in threads:
+            thread.join()
+
+        self.stats["segundos"] = round(time.time() - start, 2)
+        return self.stats
+
+
+def main():
+    """
+    Analiza en lote los documentos pasados como argumentos
+    """
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_AI_API_KEYS") or os.getenv("GOOGLE_AI_API_KEY")
+    if not api_key and os.getenv("CASSETTE_MODE", "").lower() != "replay":
+        print("❌ ERROR: No se encontró la API Key (GOOGLE_AI_API_KEY)")
+        return
+    if len(sys.argv) < 2:
+        print("Uso: python procesamiento_lotes.py contrato1.pdf contrato2.pdf ...")
+        return
+
+    store = ResultsStore(os.getenv("RESULTS_DB", "resultados.db"))
+    analyzer = ContractAnalyzer(api_key)
+    pipeline = BatchPipeline(
+        analyzer,
+        sink=store.save,
+        upload_workers=int(os.getenv("PIPELINE_UPLOAD_WORKERS", "2")),
+        wait_workers=int(os.getenv("PIPELINE_WAIT_WORKERS", "4")),
+        analysis_workers=int(os.getenv("PIPELINE_ANALYSIS_WORKERS", "4")),
+        queue_size=int(os.getenv("PIPELINE_QUEUE_SIZE", "4")),
+        hierarchical=os.getenv("HIERARCHICAL_MODE", "false").lower() == "true",
+        normalize=os.getenv("NORMALIZE_TEXT", "false").lower() == "true"
+    )
+    stats = pipeline.run(sys.argv[1:])
+    store.close()
+    analyzer.close()
+
+    print("\n" + "="*60)
+    print(f"📊 {stats['correctos']}/{stats['documentos']} documentos analizados "
+          f"en {stats['segundos']}s ({stats['fallidos']} fallidos)")
+    for priority, metrics in analyzer.scheduler.metrics().items():
+        if metrics["atendidas"]:
+            print(f"⏱️ {priority}: {metrics['atendidas']} llamadas, espera p50 "
+                  f"{metrics['espera_p50']}s / p95 {metrics['espera_p95']}s")
+    if hasattr(analyzer.client, "stats"):
+        print(f"📼 Cassette: {analyzer.client.stats.summary()}")
+    if hasattr(analyzer.client, "pool"):
+        for metrics in analyzer.client.pool.metrics():
+            print(f"🔑 Clave {metrics['clave']}: {metrics['peticiones_totales']} peticiones, "
+                  f"{metrics['archivos_fijados']} archivos, {metrics['errores_totales']} errores")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Subida por fragmentos y reanudable de archivos grandes a la API de Gemini
+
+Usa el protocolo de subida reanudable de la Files API: el archivo se lee del
+disco en bloques de tamaño fijo (la memoria no depende del tamaño del
+archivo), el progreso se guarda en disco y, tras un corte, la subida continúa
+desde el último offset confirmado por el servidor. Al terminar se compara el
+SHA-256 calculado localmente con el que devuelve la API.
+"""
+
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import socket
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+
+UPLOAD_URL = "https://generativelanguage.googleapis.com/upload/v1beta/files"
+
+# El servidor exige fragmentos múltiplos de 256 KiB (salvo el último)
+CHUNK_GRANULARITY = 256 * 1024
+
+# Errores HTTP que justifican reintentar
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class UploadError(RuntimeError):
+    """Error no recuperable durante una subida"""
+
+
+def _hash_matches(expected: str, digest: bytes) -> bool:
+    """
+    Compara el sha256Hash de la API con el SHA-256 local
+
+    La API lo devuelve en base64; según el caso, el contenido codificado es
+    el digest binario o su representación hexadecimal (64 caracteres).
+    """
+    if expected.lower() == digest.hex():
+        return True
+    try:
+        decoded = base64.b64decode(expected, validate=True)
+    except ValueError:
+        return False
+    return decoded in (digest, digest.hex().encode("ascii"))
+
+
+class ResumableUploader:
+    """
+    Subidas reanudables con memoria acotada y verificación de integridad
+    """
+
+    def __init__(self, api_key: str, chunk_size: int = 8 * 1024 * 1024,
+                 state_dir: str = ".subidas", max_retries: int = 5,
+                 timeout: float = 120, upload_url: str = UPLOAD_URL):
+        """
+        Args:
+            api_key: API key de Google AI Studio
+            chunk_size: Tamaño del bloque leído y enviado en cada petición
+            state_dir: Carpeta donde se guarda el progreso de cada subida
+            max_retries: Reintentos seguidos permitidos por fragmento
+            timeout: Timeout de cada petición HTTP en segundos
+            upload_url: Endpoint de subida de la Files API
+        """
+        self.api_key = api_key
+        self.chunk_size = max(CHUNK_GRANULARITY, chunk_size // CHUNK_GRANULARITY * CHUNK_GRANULARITY)
+        self.state_dir = Path(state_dir)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.upload_url = upload_url
+
+    def upload(self, path: str, display_name: Optional[str] = None,
+               mime_type: Optional[str] = None) -> Dict:
+        """
+        Sube un archivo, reanudando una subida previa interrumpida si existe
+
+        Args:
+            path: Ruta al archivo
+            display_name: Nombre descriptivo del documento
+            mime_type: Tipo MIME (por defecto se deduce de la extensión)
+
+        Returns:
+            Recurso File devuelto por la API (name, uri, state, sha256Hash...)
+
+        Raises:
+            UploadError: Si la subida falla o el hash no coincide
+        """
+        size = os.path.getsize(path)
+        mime_type = mime_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        display_name = display_name or Path(path).stem
+        state_path = self.state_path(path)
+
+        session_url, offset = None, 0
+        if state_path.exists():
+            with open(state_path, "r", encoding="utf-8") as f:
+                session_url = json.load(f)["url"]
+            try:
+                offset, resource = self._query(session_url)
+                if resource:
+                    # La subida ya se había completado antes de perder la respuesta
+                    return self._finish(resource, self.file_sha256(path), state_path, size)
+                print(f"↪️ Reanudando subida de {path} desde {offset / 1024 / 1024:.1f} MB")
+            except UploadError:
+                session_url, offset = None, 0  # Sesión caducada: empezar de nuevo
+
+        if not session_url:
+            session_url = self._start(size, mime_type, display_name)
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            with open(state_path, "w", encoding="utf-8") as f:
+                json.dump({"url": session_url, "ruta": str(path), "tamano": size}, f)
+
+        resource, local_digest = self._send_from(path, session_url, offset, size)
+        return self._finish(resource, local_digest, state_path, size)
+
+    def state_path(self, path: str) -> Path:
+        """
+        Archivo donde se guarda el progreso de la subida de un archivo
+
+        El progreso se asocia al archivo concreto (ruta, tamaño y fecha de
+        modificación), así que un archivo modificado empieza de cero.
+        """
+        stat = os.stat(path)
+        identity = f"{Path(path).resolve()}|{stat.st_size}|{stat.st_mtime_ns}"
+        return self.state_dir / f"{hashlib.sha1(identity.encode('utf-8')).hexdigest()}.json"
+
+    def has_pending(self, path: str) -> bool:
+        """Indica si hay una subida interrumpida de este archivo que se puede reanudar"""
+        return self.state_path(path).exists()
+
+    def _send_from(self, path: str, session_url: str, offset: int, size: int) -> Tuple[Dict, bytes]:
+        """
+        Envía el archivo desde offset en bloques de tamaño fijo
+
+        Returns:
+            Tupla (recurso File, SHA-256 local del archivo)
+        """
+        retries = 0
+        with open(path, "rb") as f:
+            digest = self._prefix_digest(f, offset)
+            while True:
+                f.seek(offset)
+                chunk = f.read(self.chunk_size)
+                final = offset + len(chunk) >= size
+                try:
+                    _, body = self._request(session_url, chunk, {
+                        "X-Goog-Upload-Command": "upload, finalize" if final else "upload",
+                        "X-Goog-Upload-Offset": str(offset)
+                    })
+                except UploadError:
+                    raise
+                except Exception as e:
+                    retries += 1
+                    if retries > self.max_retries:
+                        raise UploadError(f"Subida interrumpida en el byte {offset}: {str(e)}")
+                    time.sleep(min(30, 2 ** retries))
+                    # Preguntar al servidor cuánto recibió y continuar desde ahí
+                    try:
+                        received, resource = self._query(session_url)
+                    except UploadError:
+                        raise
+                    except Exception:
+                        continue
+                    if resource:
+                        return resource, self.file_sha256(path)
+                    if offset <= received <= offset + len(chunk):
+                        digest.update(chunk[:received - offset])
+                    else:
+                        digest = self._prefix_digest(f, received)
+                    offset = received
+                    continue
+
+                retries = 0
+                digest.update(chunk)
+                offset += len(chunk)
+                if final:
+                    return json.loads(body.decode("utf-8")).get("file", {}), digest.digest()
+
+    def _prefix_digest(self, f, end: int):
+        """SHA-256 parcial de los primeros end bytes de un archivo abierto"""
+        digest = hashlib.sha256()
+        f.seek(0)
+        remaining = end
+        while remaining > 0:
+            block = f.read(min(self.chunk_size, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+        return digest
+
+    def _finish(self, resource: Dict, local_digest: bytes, state_path: Path, size: int) -> Dict:
+        """Verifica la integridad y borra el estado de la subida"""
+        expected = resource.get("sha256Hash")
+        if expected:
+            if not _hash_matches(expected, local_digest):
+                raise UploadError("El hash SHA-256 subido no coincide con el del archivo local")
+        elif int(resource.get("sizeBytes", size)) != size:
+            raise UploadError("El tamaño subido no coincide con el del archivo local")
+        if state_path.exists():
+            state_path.unlink()
+        return resource
+
+    def file_sha256(self, path: str) -> bytes:
+        """SHA-256 del archivo leído en bloques de tamaño fijo"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(self.chunk_size), b""):
+                digest.update(block)
+        return digest.digest()
+
+    def _start(self, size: int, mime_type: str, display_name: str) -> str:
+        """Abre una sesión de subida y devuelve su URL"""
+        body = json.dumps({"file": {"display_name": display_name}}).encode("utf-8")
+        headers, _ = self._request(self.upload_url, body, {
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(size),
+            "X-Goog-Upload-Header-Content-Type": mime_type,
+            "Content-Type": "application/json"
+        }, retry=True)
+        session_url = headers.get("X-Goog-Upload-URL")
+        if not session_url:
+            raise UploadError("La API no devolvió la URL de subida")
+        return session_url
+
+    def _query(self, session_url: str) -> Tuple[int, Optional[Dict]]:
+        """
+        Consulta el estado de una sesión
+
+        Returns:
+            Tupla (bytes confirmados, recurso File si la subida ya terminó)
+        """
+        headers, body = self._request(session_url, b"", {"X-Goog-Upload-Command": "query"})
+        if headers.get("X-Goog-Upload-Status") == "final" and body:
+            return int(headers.get("X-Goog-Upload-Size-Received", 0)), json.loads(body).get("file")
+        return int(headers.get("X-Goog-Upload-Size-Received", 0)), None
+
+    def _request(self, url: str, data: bytes, headers: Dict, retry: bool = False):
+        """
+        Hace un POST y devuelve (cabeceras, cuerpo)
+
+        Los errores 4xx no recuperables se convierten en UploadError; el resto
+        se propaga para que el llamador decida si reintentar.
+        """
+        headers = dict(headers, **{"x-goog-api-key": self.api_key,
+                                   "Content-Length": str(len(data))})
+        attempts = self.max_retries + 1 if retry else 1
+        for attempt in range(1, attempts + 1):
+            request = urllib.request.Request(url, data=data, headers=headers, method="POST")
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return response.headers, response.read()
+            except urllib.error.HTTPError as e:
+                if e.code not in RETRYABLE_STATUS:
+                    detail = e.read().decode("utf-8", errors="replace")[:300]
+                    raise UploadError(f"HTTP {e.code}: {detail}")
+                if attempt == attempts:
+                    raise
+            except (urllib.error.URLError, socket.timeout, ConnectionError):
+                if attempt == attempts:
+                    raise
+            time.sleep(min(30, 2 ** attempt))